@@ -0,0 +1,195 @@
+"""Run saved scenes without the gui.
+
+Each scene is built into the same query the query browser would run and
+executed against the database, several at a time.  The rows can be written
+to a directory as CSV or JSON Lines, and the timings of each query logged.
+
+    python batch.py --database veracity --output results/ nightly/*.json
+    python batch.py --processes --workers 8 --timings timings.log *.json
+
+"""
+import os
+import sys
+import argparse
+from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
+
+from config import config_path, default_url, get_database, read_config
+from metrics import Metrics, QueryTiming
+from querybuilder import build_query
+from scenefile import build_graph, read_scene
+from writers import formats, stream
+
+
+# the database queried by the workers of this process
+database = None
+
+# rows fetched at a time
+chunk_size = 10000
+
+
+def init_worker(worker_database):
+    global database
+    database = worker_database
+
+
+def scene_query(schema, path):
+    """Get the query of a saved scene."""
+    definition = read_scene(path)
+    graph, selected = build_graph(schema, definition)
+    if not selected:
+        raise ValueError('{0}: no tables are selected'.format(path))
+    return build_query(graph, selected, definition.get('constraints', ''))[0]
+
+
+def run_scene(job):
+    """Run a saved scene, writing its rows if there is an output file.
+
+    Returns the path of the scene, its timing and the error if it failed.
+
+    """
+    path, output = job
+    timing = QueryTiming()
+    try:
+        schema = database.schema
+        with timing.phase('build'):
+            query = scene_query(schema, path)
+        with timing.phase('compile'):
+            timing.sql = str(query.compile(bind=schema.engine))
+
+        with timing.phase('connect'):
+            connection = schema.engine.connect()
+        try:
+            with timing.phase('execute'):
+                keys, cursor = stream(connection, query)
+            try:
+                with timing.phase('fetch'):
+                    timing.rows = write_rows(keys, cursor, output)
+            finally:
+                cursor.close()
+        finally:
+            connection.close()
+    except Exception as e:
+        return path, timing, '{0}: {1}'.format(type(e).__name__, e)
+    return path, timing, None
+
+
+def write_rows(keys, cursor, output):
+    """Fetch the rows a chunk at a time, writing them to the output file.
+
+    Without an output file the rows are only counted.
+
+    """
+    count = 0
+    f = writer = None
+    if output is not None:
+        extension = os.path.splitext(output)[1].lstrip('.')
+        f = open(output, 'wb')
+        writer = formats[extension](f, keys)
+    try:
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            if writer is not None:
+                writer.write(rows)
+            count += len(rows)
+    finally:
+        if f is not None:
+            f.close()
+    return count
+
+
+def output_paths(directory, paths, extension):
+    """Get a file in the directory for each scene, named after the scene.
+
+    Scenes with the same name are numbered so they don't write to the same
+    file.
+
+    """
+    if directory is None:
+        return [None] * len(paths)
+    outputs = []
+    used = set()
+    for path in paths:
+        name = os.path.splitext(os.path.basename(path))[0]
+        output = name
+        count = 1
+        while output in used:
+            count += 1
+            output = '{0}_{1}'.format(name, count)
+        used.add(output)
+        outputs.append(os.path.join(directory,
+                                    '{0}.{1}'.format(output, extension)))
+    return outputs
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('scenes', nargs='+', metavar='scene',
+                        help='saved scene file')
+    parser.add_argument('--database',
+                        help='configured name or SQLAlchemy URL')
+    parser.add_argument('--config', default=config_path,
+                        help='config file (default: %(default)s)')
+    parser.add_argument('--workers', type=int, default=4,
+                        help='scenes run at once (default: %(default)s)')
+    parser.add_argument('--processes', action='store_true',
+                        help='run the scenes in processes, not threads')
+    parser.add_argument('--output', metavar='DIR',
+                        help='write the rows of each scene to DIR')
+    parser.add_argument('--format', choices=list(formats), default='csv')
+    parser.add_argument('--timings', metavar='FILE',
+                        help='append query timings to FILE as JSON lines')
+    parser.add_argument('--sql', action='store_true',
+                        help='print the SQL of each scene instead')
+    options = parser.parse_args(args)
+
+    databases, default = read_config(options.config)
+    worker_database = get_database(databases, options.database or default or
+                                   default_url)
+    if options.sql:
+        schema = worker_database.schema
+        for path in options.scenes:
+            query = scene_query(schema, path)
+            print '-- {0}'.format(path)
+            print '{0};'.format(query.compile(bind=schema.engine))
+        return 0
+
+    if options.output and not os.path.isdir(options.output):
+        os.makedirs(options.output)
+    jobs = zip(options.scenes, output_paths(options.output, options.scenes,
+                                            options.format))
+
+    # every worker thread needs a connection of its own
+    if worker_database.pool_size < options.workers:
+        worker_database.pool_size = options.workers
+    if options.processes:
+        pool = Pool(options.workers, init_worker, (worker_database,))
+    else:
+        init_worker(worker_database)
+        # load the schema once, before the threads share it
+        worker_database.schema
+        pool = ThreadPool(options.workers)
+
+    metrics = Metrics(options.timings)
+    failed = 0
+    try:
+        for path, timing, error in pool.imap_unordered(run_scene, jobs):
+            if error is None:
+                metrics.record(timing)
+                print '{0}: {1}'.format(path, timing.summary())
+            else:
+                failed += 1
+                print >> sys.stderr, '{0}: failed: {1}'.format(path, error)
+    finally:
+        pool.close()
+        pool.join()
+        if not options.processes:
+            worker_database.schema.save()
+        worker_database.dispose()
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
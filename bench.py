@@ -0,0 +1,356 @@
+"""Benchmark the hot paths of the query browser.
+
+Synthetic SQLite databases are built with the requested number of tables,
+foreign keys and rows.  Each operation is timed, and run once more in a
+forked copy of the process to measure the memory it adds.  Results can be
+saved as a baseline and later runs compared against it to catch
+regressions in time or memory.
+
+Benchmarks of widgets need PyQt4 and a display, they are skipped when
+PyQt4 isn't installed.  On a machine without a display run them under a
+virtual one:
+
+    xvfb-run python bench.py --preset small
+
+    python bench.py --preset medium --save baseline.json
+    python bench.py --preset medium --compare baseline.json
+
+"""
+import os
+import gc
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import resource
+import tempfile
+
+import numpy as np
+from sqlalchemy import (create_engine, MetaData, Table, Column, Integer,
+                        String, ForeignKey, select)
+
+from fkgraph import FkGraph
+from layout import LayoutEngine
+from querybuilder import build_query
+from scenefile import build_graph
+from schema import Schema
+
+try:
+    from PyQt4.QtGui import QApplication
+except ImportError:
+    QApplication = None
+
+
+presets = {
+    'small': dict(tables=10, fks=15, rows=10000),
+    'medium': dict(tables=1000, fks=3000, rows=100000),
+    'large': dict(tables=10000, fks=30000, rows=1000000),
+}
+
+
+def build_database(path, tables, fks, rows, seed=0):
+    """Create a SQLite database with a random schema.
+
+    Every table has an id, a name and a value.  Foreign keys are added as
+    extra columns pointing at the id of a random other table.  All the rows
+    go in the first table and its first neighbour.
+
+    """
+    random.seed(seed)
+    engine = create_engine('sqlite:///' + path)
+    meta = MetaData()
+    names = ['table_{0}'.format(i) for i in range(tables)]
+    columns = dict((x, []) for x in names)
+    for i in range(fks):
+        source = random.choice(names)
+        target = random.choice(names)
+        columns[source].append(Column('{0}_{1}_id'.format(target, i), Integer,
+                                      ForeignKey(target + '.id')))
+
+    # make sure the first table has a neighbour to join to
+    if tables > 1:
+        columns[names[0]].append(Column('table_1_id', Integer,
+                                        ForeignKey('table_1.id')))
+
+    for name in names:
+        Table(name, meta, Column('id', Integer, primary_key=True),
+              Column('name', String(50)), Column('value', Integer),
+              *columns[name])
+    # the foreign keys have cycles, which create_all can't order
+    for name in names:
+        meta.tables[name].create(engine)
+
+    for table in [meta.tables[x] for x in names[:2]]:
+        fk_names = [c.name for c in table.c if c.foreign_keys]
+        chunk = []
+        for i in range(rows):
+            row = {'id': i + 1, 'name': 'name {0}'.format(i), 'value': i % 97}
+            for fk in fk_names:
+                row[fk] = random.randint(1, rows)
+            chunk.append(row)
+            if len(chunk) == 10000:
+                engine.execute(table.insert(), chunk)
+                chunk = []
+        if chunk:
+            engine.execute(table.insert(), chunk)
+    return engine
+
+
+def peak_memory():
+    """Peak resident memory of the process, kilobytes on Linux."""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def memory_growth(func):
+    """Measure the peak memory an operation adds, in kilobytes.
+
+    The peak of a process only grows, so an operation is run in a forked
+    copy, whose peak starts at the memory in use when it is forked.  None
+    is returned where processes can't be forked.
+
+    """
+    if not hasattr(os, 'fork'):
+        return None
+    read, write = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        try:
+            os.close(read)
+            gc.collect()
+            start = peak_memory()
+            func()
+            os.write(write, str(peak_memory() - start))
+        finally:
+            os._exit(0)
+    os.close(write)
+    with os.fdopen(read) as f:
+        growth = f.read()
+    os.waitpid(pid, 0)
+    return int(growth) if growth else None
+
+
+class Runner(object):
+    """Time operations and keep the results."""
+
+    def __init__(self, repeat):
+        self.repeat = repeat
+        self.results = {}
+
+    def time(self, name, func, repeat=None):
+        """Run an operation, keeping the best time and memory growth."""
+        gc.collect()
+        times = []
+        for i in range(repeat or self.repeat):
+            start = time.time()
+            func()
+            times.append(time.time() - start)
+        result = {'seconds': min(times),
+                  'median': sorted(times)[len(times) // 2],
+                  'memory_kb': memory_growth(func)}
+        self.results[name] = result
+        print '{0:<32} {1:>10.3f} ms {2:>10} kB'.format(
+            name, result['seconds'] * 1000, result['memory_kb'])
+        return result
+
+
+def bench_schema(runner, engine, cache_dir):
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    runner.time('schema_cold_start',
+                lambda: (shutil.rmtree(cache_dir, ignore_errors=True),
+                         Schema(engine, cache_dir)), repeat=1)
+    runner.time('schema_warm_start', lambda: Schema(engine, cache_dir))
+    return Schema(engine, cache_dir)
+
+
+def bench_graph(runner, schema):
+    names = schema.names
+    runner.time('fkgraph_build',
+                lambda: FkGraph(names, schema.foreign_keys))
+    graph = schema.graph
+    sample = [random.choice(names) for i in range(1000)]
+    runner.time('fk_neighbours_x1000',
+                lambda: [graph.neighbours(x) for x in sample])
+    pairs = [(random.choice(names), random.choice(names)) for i in range(20)]
+    runner.time('shortest_path_x20',
+                lambda: [graph.shortest_path(a, b) for a, b in pairs])
+    runner.time('k_shortest_paths_x20',
+                lambda: [graph.shortest_paths(a, b, 5) for a, b in pairs],
+                repeat=1)
+
+
+def bench_layout(runner, sizes):
+    for n in sizes:
+        engine = LayoutEngine()
+        positions = np.random.rand(n, 2) * np.sqrt(n)
+        for x, y in positions:
+            engine.add_node(x, y)
+        for i in range(1, n):
+            engine.add_edge(random.randrange(i), i)
+        runner.time('layout_step_{0}'.format(n), engine.step)
+
+
+def bench_fetch(runner, engine, schema):
+    table = schema.table(schema.names[0])
+    query = select([table]).compile(bind=engine)
+
+    def fetch():
+        connection = engine.connect()
+        try:
+            result = connection.execute(query)
+            rows = []
+            while True:
+                batch = result.fetchmany(256)
+                if not batch:
+                    break
+                rows.extend(tuple(x) for x in batch)
+            result.close()
+        finally:
+            connection.close()
+        return rows
+    runner.time('fetch_all_rows', fetch, repeat=1)
+
+
+def bench_query(runner, schema):
+    """Build the query of the first table joined to its neighbours."""
+    names = schema.names
+    tables = [{'name': names[0], 'alias': 't0', 'selected': True}]
+    relations = []
+    for i, name in enumerate(list(schema.graph.neighbours(names[0]))[:10]):
+        alias = 't{0}'.format(i + 1)
+        tables.append({'name': name, 'alias': alias, 'selected': False})
+        relations.append({'from': 't0', 'to': alias})
+    definition = {'tables': tables, 'relations': relations}
+
+    def build():
+        graph, selected = build_graph(schema, definition)
+        query, key_indexes = build_query(graph, selected)
+        return str(query.compile(bind=schema.engine))
+    runner.time('build_query', build)
+
+
+def bench_qt(runner, schema):
+    if QApplication is None:
+        print 'PyQt4 not installed, skipping Qt benchmarks'
+        return
+    from PyQt4.QtCore import QModelIndex
+    from joinlist import JoinList
+    from results import ResultModel
+
+    app = QApplication.instance() or QApplication(sys.argv[:1])
+    names = schema.names
+
+    joins = JoinList(names, schema)
+    runner.time('join_list_text_filter',
+                lambda: [joins.text_filter.edit.setText(x)
+                         for x in ('t', 'ta', 'tab', '')], repeat=3)
+    runner.time('join_list_fk_filter',
+                lambda: [joins.fk_filter.edit.setText(random.choice(names))
+                         for x in range(4)], repeat=3)
+
+    table = schema.table(names[0])
+    result = schema.engine.execute(select([table]).limit(100000))
+    keys, rows = result.keys(), [tuple(x) for x in result]
+    model = ResultModel()
+
+    def populate():
+        model.set_results(keys, rows)
+        for row in range(min(50, len(rows))):
+            for column in range(len(keys)):
+                model.data(model.index(row, column))
+    runner.time('result_model_populate', populate)
+    del app
+
+
+# memory growth below this many kilobytes is noise, not a regression
+memory_noise = 1024
+
+
+def compare(results, baseline, tolerance):
+    """Print the change against a baseline, returning the regressions."""
+    regressions = []
+    print
+    print '{0:<32} {1:>12} {2:>12} {3:>8} {4:>10} {5:>10} {6:>8}'.format(
+        'operation', 'base time', 'time', 'change', 'base mem', 'memory',
+        'change')
+    for name in sorted(results):
+        if name not in baseline:
+            continue
+        old = baseline[name]['seconds']
+        new = results[name]['seconds']
+        change = (new - old) / old if old else 0.0
+        flags = []
+        if change > tolerance:
+            flags.append('TIME')
+
+        old_memory = baseline[name].get('memory_kb')
+        new_memory = results[name].get('memory_kb')
+        memory_change = 0.0
+        if old_memory is not None and new_memory is not None:
+            growth = new_memory - old_memory
+            if old_memory:
+                memory_change = float(growth) / old_memory
+            if growth > memory_noise and \
+                    growth > tolerance * max(old_memory, memory_noise):
+                flags.append('MEMORY')
+        if flags:
+            regressions.append(name)
+        print ('{0:<32} {1:>9.3f} ms {2:>9.3f} ms {3:>+7.0%} {4:>7} kB '
+               '{5:>7} kB {6:>+7.0%}{7}').format(
+            name, old * 1000, new * 1000, change, old_memory, new_memory,
+            memory_change, ''.join(' ' + x + ' REGRESSION' for x in flags))
+    return regressions
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--preset', choices=sorted(presets), default='small')
+    parser.add_argument('--tables', type=int)
+    parser.add_argument('--fks', type=int)
+    parser.add_argument('--rows', type=int)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--save', help='write the results to this file')
+    parser.add_argument('--compare', help='compare with a saved baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='slowdown flagged as a regression (0.25 = 25%%)')
+    options = parser.parse_args(args)
+
+    settings = dict(presets[options.preset])
+    for key in ('tables', 'fks', 'rows'):
+        if getattr(options, key) is not None:
+            settings[key] = getattr(options, key)
+
+    directory = tempfile.mkdtemp(prefix='querybrowser-bench-')
+    try:
+        print 'building database: {tables} tables, {fks} fks, {rows} rows'\
+            .format(**settings)
+        engine = build_database(os.path.join(directory, 'bench.db'),
+                                **settings)
+        runner = Runner(options.repeat)
+        schema = bench_schema(runner, engine, os.path.join(directory, 'cache'))
+        bench_graph(runner, schema)
+        bench_layout(runner, (50, 500, 2000))
+        bench_fetch(runner, engine, schema)
+        bench_query(runner, schema)
+        bench_qt(runner, schema)
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+    output = {'settings': settings, 'results': runner.results}
+    if options.save:
+        with open(options.save, 'w') as f:
+            json.dump(output, f, indent=2, sort_keys=True)
+    if options.compare:
+        with open(options.compare) as f:
+            baseline = json.load(f)
+        if baseline.get('settings') != settings:
+            print 'warning: baseline was run with {0}'.format(
+                baseline.get('settings'))
+        if compare(runner.results, baseline['results'], options.tolerance):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,84 @@
+import sys
+import time
+from collections import OrderedDict
+
+
+def result_key(compiled):
+    """Get the cache key of a compiled query, its SQL and bound parameters."""
+    params = sorted(compiled.params.items())
+    try:
+        hash(tuple(params))
+    except TypeError:
+        params = repr(params)
+    else:
+        params = tuple(params)
+    return str(compiled), params
+
+
+def result_size(keys, rows):
+    """Estimate the memory used by a result in bytes."""
+    size = sys.getsizeof(rows) + sum(sys.getsizeof(x) for x in keys)
+    for row in rows:
+        size += sys.getsizeof(row)
+        for value in row:
+            size += sys.getsizeof(value)
+    return size
+
+
+class ResultCache(object):
+    """Cache of query results with a memory budget and time to live.
+
+    Results are kept until they expire or the cache goes over its budget,
+    in which case the least recently used results are dropped first.
+
+    """
+
+    # bytes of results to keep
+    max_bytes = 64 * 1024 * 1024
+    # seconds a result stays valid
+    ttl = 300
+
+    def __init__(self, max_bytes=None, ttl=None):
+        """Initialize an empty cache."""
+        if max_bytes is not None:
+            self.max_bytes = max_bytes
+        if ttl is not None:
+            self.ttl = ttl
+        self.entries = OrderedDict()
+        self.size = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        """Get the keys and rows of a cached result, None if there isn't one."""
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return None
+        created, size, keys, rows = entry
+        if time.time() - created > self.ttl:
+            self.size -= size
+            return None
+        self.entries[key] = entry
+        return keys, rows
+
+    def put(self, key, keys, rows):
+        """Cache a result, unless it is bigger than the whole budget."""
+        self.discard(key)
+        size = result_size(keys, rows)
+        if size > self.max_bytes:
+            return
+        self.entries[key] = (time.time(), size, list(keys), rows)
+        self.size += size
+        while self.size > self.max_bytes:
+            _, entry = self.entries.popitem(last=False)
+            self.size -= entry[1]
+
+    def discard(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry[1]
+
+    def clear(self):
+        self.entries.clear()
+        self.size = 0
@@ -0,0 +1,244 @@
+import os
+import argparse
+import ConfigParser
+from collections import OrderedDict
+
+from sqlalchemy import create_engine, event, exc
+from sqlalchemy.engine.url import make_url
+
+from cache import ResultCache
+from explain import CostGuard
+from schema import Schema
+
+
+# where the connection settings are read from
+config_path = os.path.expanduser(os.path.join('~', '.querybrowser',
+                                              'config.ini'))
+# used when nothing is configured
+default_url = 'mysql://root@localhost/veracity'
+
+
+def ping_connection(dbapi_connection, connection_record, connection_proxy):
+    """Check a connection is alive when it is taken from the pool.
+
+    A dead connection raises DisconnectionError, the pool then throws it
+    away and tries again with a new one.
+
+    """
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute('SELECT 1')
+    except Exception:
+        raise exc.DisconnectionError()
+    finally:
+        cursor.close()
+
+
+class Database(object):
+    """A database to browse, along with its engine and schema.
+
+    The engine and schema are created the first time they are used, so
+    configuring a database doesn't connect to it.  Each database has its own
+    pool and metadata.
+
+    """
+
+    pool_size = 5
+    max_overflow = 10
+    pool_timeout = 30
+    pool_recycle = 3600
+    pre_ping = True
+    # file query timings are appended to as JSON lines
+    metrics_log = None
+    # explain queries before running them
+    explain = False
+    # queries expected to examine more rows than this are held
+    cost_threshold = None
+    # held queries aren't run at all, instead of asking first
+    block_costly = False
+    # run the queries of neighbouring tables while the user is idle
+    prefetch = False
+    # megabytes of results cached, None for the default of the cache
+    cache_size = None
+    # seconds a cached result is used for, None for the default of the cache
+    cache_ttl = None
+
+    def __init__(self, name, url, **options):
+        """Keep the settings, options left as None use the defaults."""
+        self.name = name
+        self.url = url
+        for key, value in options.items():
+            if value is not None:
+                setattr(self, key, value)
+        self._engine = None
+        self._schema = None
+
+    @property
+    def engine(self):
+        if self._engine is None:
+            self._engine = self.create_engine()
+        return self._engine
+
+    @property
+    def schema(self):
+        if self._schema is None:
+            self._schema = Schema(self.engine)
+        return self._schema
+
+    def cost_guard(self):
+        """Get the guard queries are explained by, None if they aren't."""
+        if not self.explain and self.cost_threshold is None:
+            return None
+        return CostGuard(self.cost_threshold, self.block_costly)
+
+    def result_cache(self):
+        """Get a result cache with the configured budget and time to live."""
+        max_bytes = None
+        if self.cache_size is not None:
+            max_bytes = self.cache_size * 1024 * 1024
+        return ResultCache(max_bytes, self.cache_ttl)
+
+    def create_engine(self):
+        """Create the engine with the configured pool.
+
+        SQLite doesn't pool connections the same way, so the pool settings
+        only apply to other databases.  Its connections are allowed to move
+        between threads since queries run on worker threads.
+
+        """
+        url = make_url(self.url)
+        if url.drivername.startswith('sqlite'):
+            engine = create_engine(url,
+                                   connect_args={'check_same_thread': False})
+        else:
+            engine = create_engine(url, pool_size=self.pool_size,
+                                   max_overflow=self.max_overflow,
+                                   pool_timeout=self.pool_timeout,
+                                   pool_recycle=self.pool_recycle)
+        if self.pre_ping:
+            event.listen(engine.pool, 'checkout', ping_connection)
+        return engine
+
+    def dispose(self):
+        """Close the connections in the pool."""
+        if self._engine is not None:
+            self._engine.dispose()
+
+
+def read_config(path=config_path):
+    """Read the databases from a config file.
+
+    Each database has its own section::
+
+        [querybrowser]
+        default = veracity
+
+        [database veracity]
+        url = mysql://root@localhost/veracity
+        pool_size = 5
+        pre_ping = yes
+        metrics_log = ~/.querybrowser/veracity.log
+        explain = yes
+        cost_threshold = 1000000
+        block_costly = no
+        prefetch = yes
+        cache_size = 64
+        cache_ttl = 300
+
+    Returns the databases by name and the name of the default database.
+
+    """
+    parser = ConfigParser.SafeConfigParser()
+    parser.read([path])
+    databases = OrderedDict()
+    for section in parser.sections():
+        if not section.startswith('database '):
+            continue
+        name = section[len('database '):].strip()
+        options = {}
+        for key in ('pool_size', 'max_overflow', 'pool_timeout',
+                    'pool_recycle', 'cost_threshold', 'cache_size',
+                    'cache_ttl'):
+            if parser.has_option(section, key):
+                options[key] = parser.getint(section, key)
+        for key in ('pre_ping', 'explain', 'block_costly', 'prefetch'):
+            if parser.has_option(section, key):
+                options[key] = parser.getboolean(section, key)
+        if parser.has_option(section, 'metrics_log'):
+            options['metrics_log'] = parser.get(section, 'metrics_log')
+        databases[name] = Database(name, parser.get(section, 'url'), **options)
+
+    default = None
+    if parser.has_option('querybrowser', 'default'):
+        default = parser.get('querybrowser', 'default')
+    return databases, default
+
+
+def get_database(databases, name):
+    """Get a configured database, or add one for a SQLAlchemy URL."""
+    database = databases.get(name)
+    if database is None:
+        database = databases[name] = Database(name, name)
+    return database
+
+
+def parse_args(args):
+    """Get the configured databases and the ones to open.
+
+    Databases are given on the command line by name or by SQLAlchemy URL,
+    pool, logging, explain, prefetch and cache options given on the command
+    line apply to each of them.  Without any the default database is opened.
+
+    """
+    parser = argparse.ArgumentParser(description='Browse a database.')
+    parser.add_argument('databases', nargs='*', metavar='database',
+                        help='configured name or SQLAlchemy URL')
+    parser.add_argument('--config', default=config_path,
+                        help='config file (default: %(default)s)')
+    parser.add_argument('--pool-size', type=int)
+    parser.add_argument('--max-overflow', type=int)
+    parser.add_argument('--pool-timeout', type=int, help='seconds')
+    parser.add_argument('--pool-recycle', type=int, help='seconds')
+    parser.add_argument('--no-pre-ping', dest='pre_ping',
+                        action='store_false', default=None,
+                        help="don't check connections before using them")
+    parser.add_argument('--metrics-log', metavar='FILE',
+                        help='append query timings to FILE as JSON lines')
+    parser.add_argument('--explain', action='store_true', default=None,
+                        help='show the plan of each query before running it')
+    parser.add_argument('--cost-threshold', type=int, metavar='ROWS',
+                        help='ask before running queries expected to '
+                        'examine more rows')
+    parser.add_argument('--block-costly', action='store_true', default=None,
+                        help="don't run those queries at all")
+    parser.add_argument('--prefetch', action='store_true', default=None,
+                        help='run the queries of neighbouring tables while '
+                        'idle')
+    parser.add_argument('--cache-size', type=int, metavar='MB',
+                        help='megabytes of query results to cache')
+    parser.add_argument('--cache-ttl', type=int, help='seconds')
+    options = parser.parse_args(args)
+
+    databases, default = read_config(options.config)
+    names = options.databases or [default or default_url]
+    overrides = dict(pool_size=options.pool_size,
+                     max_overflow=options.max_overflow,
+                     pool_timeout=options.pool_timeout,
+                     pool_recycle=options.pool_recycle,
+                     pre_ping=options.pre_ping,
+                     metrics_log=options.metrics_log,
+                     explain=options.explain,
+                     cost_threshold=options.cost_threshold,
+                     block_costly=options.block_costly,
+                     prefetch=options.prefetch,
+                     cache_size=options.cache_size,
+                     cache_ttl=options.cache_ttl)
+
+    selected = []
+    for name in names:
+        database = get_database(databases, name)
+        for key, value in overrides.items():
+            if value is not None:
+                setattr(database, key, value)
+        selected.append(database)
+    return databases, selected
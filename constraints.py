@@ -0,0 +1,107 @@
+import re
+
+from sqlalchemy.exc import SQLAlchemyError
+
+from explain import explain
+
+
+# tokens that can't start or end a where clause
+operators = set(['and', 'or', 'not', 'like', 'in', 'is', 'between', 'regexp',
+                 '=', '<', '>', '<=', '>=', '<>', '!=', '<=>', '+', '-', '*',
+                 '/', '%', ',', '&&', '||'])
+binary = operators - set(['not', '-'])
+
+token_re = re.compile(r"(<=>|<=|>=|<>|!=|&&|\|\||\w+|[^\w\s])")
+
+
+def constraint_error(text):
+    """Check a where clause fragment before it is sent to the database.
+
+    This only looks at the tokens, so it catches nothing but the mistakes
+    made while typing: unclosed quotes or parentheses, a dangling operator
+    and extra statements.  Anything else, such as an unknown column, is left
+    to database_error.  An error message is returned, or None if the
+    fragment looks complete.
+
+    """
+    tokens = []
+    depth = 0
+    quote = None
+    i = 0
+    while i < len(text):
+        char = text[i]
+        if quote:
+            if char == '\\' and quote != '`':
+                i += 1
+            elif char == quote:
+                if text[i + 1:i + 2] == quote:
+                    i += 1
+                else:
+                    quote = None
+                    tokens.append('literal')
+            i += 1
+            continue
+
+        if char.isspace():
+            i += 1
+            continue
+        if char in '\'"`':
+            quote = char
+            i += 1
+            continue
+        match = token_re.match(text, i)
+        if match is None:
+            break
+        token = match.group(1).lower()
+        if token == '(':
+            depth += 1
+        elif token == ')':
+            depth -= 1
+            if depth < 0:
+                return 'Unmatched )'
+        elif token == ';':
+            return 'Only a single where clause is allowed'
+        tokens.append(token)
+        i = match.end()
+
+    if quote:
+        return 'Unclosed {0}'.format(quote)
+    if depth:
+        return 'Unclosed ('
+    if not tokens:
+        return None
+    if tokens[0] in binary:
+        return 'Missing operand before {0}'.format(tokens[0].upper())
+    if tokens[-1] in operators or tokens[-1] == '(':
+        return 'Missing operand after {0}'.format(tokens[-1].upper())
+    return None
+
+
+def database_error(engine, query):
+    """Check that the database accepts a query, without running it.
+
+    The query is explained, which makes the database parse it and look up
+    its tables and columns.  The error of the database is returned, or None
+    if there isn't one, the database can't explain queries or it can't be
+    reached, which running the query reports anyway.
+
+    """
+    try:
+        connection = engine.connect()
+    except SQLAlchemyError:
+        return None
+    try:
+        explain(connection, query.compile(dialect=connection.dialect))
+    except connection.dialect.dbapi.Error as e:
+        # drivers differ in where they put the message
+        return error_message(e.args[-1] if e.args else e)
+    except SQLAlchemyError as e:
+        return error_message(e)
+    finally:
+        connection.close()
+    return None
+
+
+def error_message(error):
+    """Get the first line of an error, without surrounding space."""
+    return str(error).strip().split('\n')[0]
@@ -0,0 +1,24 @@
+from PyQt4.QtCore import QThread
+
+from constraints import database_error
+
+
+class ConstraintThread(QThread):
+    """Ask the database about the constraints of a query in the background.
+
+    Checking needs a connection and a round trip, either of which can take
+    a while, so the gui only hears about it once the thread finishes.  The
+    error of the database is left in error, None if it took the query.
+
+    """
+
+    def __init__(self, engine, query, text):
+        """Initialize thread for a query with the constraints in text."""
+        QThread.__init__(self)
+        self.engine = engine
+        self.query = query
+        self.text = text
+        self.error = None
+
+    def run(self):
+        self.error = database_error(self.engine, self.query)
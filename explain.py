@@ -0,0 +1,175 @@
+import re
+from collections import OrderedDict
+
+
+# how each database is asked for the plan of a query
+explain_prefixes = {'mysql': 'EXPLAIN ', 'postgresql': 'EXPLAIN ',
+                    'sqlite': 'EXPLAIN QUERY PLAN '}
+
+
+class QueryPlan(object):
+    """The plan the database has for a query.
+
+    The estimate is the number of rows the database expects to examine,
+    None if it doesn't say.  Warnings point out the parts of the plan that
+    are likely to be slow.
+
+    """
+
+    def __init__(self, sql, keys, rows, estimate=None, warnings=None):
+        self.sql = sql
+        self.keys = list(keys)
+        self.rows = [tuple(x) for x in rows]
+        self.estimate = estimate
+        self.warnings = list(warnings or [])
+
+    def summary(self):
+        """Describe the plan as text, its rows lined up in columns."""
+        lines = []
+        if self.estimate is None:
+            lines.append('Rows examined: unknown')
+        else:
+            lines.append('Rows examined: about {0:,}'.format(self.estimate))
+        lines.extend('Warning: {0}'.format(x) for x in self.warnings)
+        lines.append('')
+
+        table = [self.keys] + [['' if x is None else str(x) for x in row]
+                               for row in self.rows]
+        widths = [max(len(str(x[i])) for x in table)
+                  for i in range(len(self.keys))]
+        for row in table:
+            lines.append('  '.join(str(x).ljust(widths[i])
+                                   for i, x in enumerate(row)).rstrip())
+        return '\n'.join(lines)
+
+
+def mysql_plan(keys, rows):
+    """Estimate and warnings of a MySQL plan.
+
+    Tables are joined in nested loops, so the rows examined are the product
+    of the rows each step of the plan expects.
+
+    """
+    estimate = 1
+    warnings = []
+    for row in rows:
+        row = dict(zip(keys, row))
+        estimate *= int(row.get('rows') or 1)
+        table = row.get('table')
+        extra = row.get('Extra') or ''
+        if row.get('type') == 'ALL':
+            warnings.append('full scan of {0}'.format(table))
+        if 'join buffer' in extra:
+            warnings.append('{0} is joined without an index'.format(table))
+    return estimate, warnings
+
+
+def postgresql_plan(keys, rows):
+    """Estimate and warnings of a PostgreSQL plan.
+
+    The top of the plan has the rows of the whole query, scans further
+    down are what is worth a warning.
+
+    """
+    estimate = None
+    warnings = []
+    for row in rows:
+        line = row[0]
+        if estimate is None:
+            match = re.search(r'rows=(\d+)', line)
+            if match:
+                estimate = int(match.group(1))
+        match = re.search(r'Seq Scan on (\S+)', line)
+        if match:
+            warnings.append('full scan of {0}'.format(match.group(1)))
+    return estimate, warnings
+
+
+def sqlite_plan(keys, rows):
+    """Warnings of a SQLite plan, which doesn't estimate rows."""
+    warnings = []
+    for row in rows:
+        detail = str(row[-1])
+        if detail.startswith('SCAN') and 'INDEX' not in detail:
+            warnings.append('full scan ({0})'.format(detail))
+    return None, warnings
+
+
+readers = {'mysql': mysql_plan, 'postgresql': postgresql_plan,
+           'sqlite': sqlite_plan}
+
+
+def explain(connection, compiled):
+    """Ask the database for the plan of a compiled query.
+
+    Returns None for databases that can't explain a query.
+
+    """
+    dialect = connection.dialect
+    prefix = explain_prefixes.get(dialect.name)
+    if prefix is None:
+        return None
+    params = compiled.construct_params()
+    if compiled.positional:
+        params = [params[x] for x in compiled.positiontup]
+    sql = str(compiled)
+    cursor = connection.connection.cursor()
+    try:
+        cursor.execute(prefix + sql, params)
+        keys = [x[0] for x in cursor.description]
+        rows = cursor.fetchall()
+    finally:
+        cursor.close()
+    estimate, warnings = readers[dialect.name](keys, rows)
+    return QueryPlan(sql, keys, rows, estimate, warnings)
+
+
+class PlanCache(object):
+    """Plans of recently run queries, keyed on their SQL.
+
+    Pages of the same query only differ in their parameters, so they share
+    a plan.
+
+    """
+
+    size = 256
+
+    def __init__(self, size=None):
+        if size is not None:
+            self.size = size
+        self.entries = OrderedDict()
+
+    def get(self, sql):
+        plan = self.entries.pop(sql, None)
+        if plan is not None:
+            self.entries[sql] = plan
+        return plan
+
+    def put(self, plan):
+        self.entries.pop(plan.sql, None)
+        self.entries[plan.sql] = plan
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+
+
+class CostGuard(object):
+    """Decide which queries are too costly to run without asking.
+
+    Queries expected to examine more rows than the threshold are held.
+    With block set they aren't run at all, otherwise the user is asked.
+
+    """
+
+    def __init__(self, threshold=None, block=False):
+        self.threshold = threshold
+        self.block = block
+        self.plans = PlanCache()
+
+    def holds(self, plan):
+        """Check if a query with this plan should be held."""
+        if plan is None or plan.estimate is None or self.threshold is None:
+            return False
+        return plan.estimate > self.threshold
@@ -0,0 +1,81 @@
+import os
+import threading
+
+from PyQt4.QtCore import QThread, pyqtSignal
+
+from runner import connection_id, interrupt, release
+from writers import CsvWriter, formats, stream
+
+
+class ExportThread(QThread):
+    """Write every row of a query to a file away from the gui thread.
+
+    Rows are fetched and written a chunk at a time, so memory use doesn't
+    grow with the size of the result.  The file is written under a temporary
+    name and only renamed once every row is in it.
+
+    """
+
+    chunk_size = 10000
+
+    # the number of rows written so far
+    progress = pyqtSignal(int)
+
+    def __init__(self, engine, query, path, writer=None):
+        """Initialize thread, the writer is picked from the extension."""
+        QThread.__init__(self)
+        self.engine = engine
+        self.query = query
+        self.path = path
+        if writer is None:
+            extension = os.path.splitext(path)[1].lstrip('.').lower()
+            writer = formats.get(extension, CsvWriter)
+        self.writer = writer
+        self.rows = 0
+        self.cancelled = False
+        self.lock = threading.Lock()
+        self.connection = None
+        self.connection_id = None
+        self.error = None
+
+    def run(self):
+        tmp = self.path + '.part'
+        try:
+            connection = self.engine.connect()
+            try:
+                self.connection_id = connection_id(connection)
+                self.connection = connection
+                if self.cancelled:
+                    return
+                keys, cursor = stream(connection, self.query)
+                try:
+                    self.write(tmp, keys, cursor)
+                finally:
+                    cursor.close()
+            finally:
+                release(self)
+                connection.close()
+            if not self.cancelled:
+                os.rename(tmp, self.path)
+        except Exception as e:
+            if not self.cancelled:
+                self.error = e
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    def write(self, path, keys, cursor):
+        with open(path, 'wb') as f:
+            writer = self.writer(f, keys)
+            while not self.cancelled:
+                rows = cursor.fetchmany(self.chunk_size)
+                if not rows:
+                    break
+                writer.write(rows)
+                self.rows += len(rows)
+                self.progress.emit(self.rows)
+
+    def cancel(self):
+        """Stop the export, the partly written file is removed."""
+        self.cancelled = True
+        interrupt(self)
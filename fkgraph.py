@@ -0,0 +1,158 @@
+from sqlalchemy import and_
+
+
+class FkGraph(object):
+    """Index of the foreign keys between tables.
+
+    Tables are nodes and foreign keys are edges in both directions, so the
+    tables connected to a table can be found without scanning the schema.
+    The columns to join on are kept for every pair of connected tables.
+
+    """
+
+    def __init__(self, names, foreign_keys):
+        """Build the index from table names and foreign key tuples.
+
+        Each foreign key is a tuple of (table, columns, referred table,
+        referred columns) as found on Schema.
+
+        """
+        self.names = frozenset(names)
+        adjacency = {}
+        pairs = {}
+        for table, columns, referred, referred_columns in foreign_keys:
+            adjacency.setdefault(table, set()).add(referred)
+            adjacency.setdefault(referred, set()).add(table)
+            pairs.setdefault((table, referred), []).append(
+                (tuple(columns), tuple(referred_columns)))
+            if table != referred:
+                pairs.setdefault((referred, table), []).append(
+                    (tuple(referred_columns), tuple(columns)))
+        self.adjacency = dict((k, frozenset(v)) for k, v in adjacency.iteritems())
+        self.pairs = pairs
+
+    def neighbours(self, name):
+        """Get the names of the tables connected to a table."""
+        return self.adjacency.get(name, frozenset())
+
+    def is_connected(self, left, right):
+        return (left, right) in self.pairs
+
+    def column_pairs(self, left, right):
+        """Get the columns joining two tables.
+
+        This is a list with an entry for every foreign key between them, each
+        entry being a tuple of the left columns and the right columns.
+
+        """
+        return self.pairs.get((left, right), [])
+
+    def condition(self, left_name, left, right_name, right):
+        """Get the join condition between two (possibly aliased) tables.
+
+        The first foreign key between them is used, composite keys compare
+        every column.  None is returned if they aren't connected.
+
+        """
+        pairs = self.column_pairs(left_name, right_name)
+        if not pairs:
+            return None
+        left_columns, right_columns = pairs[0]
+        clauses = [left.c[x] == right.c[y]
+                   for x, y in zip(left_columns, right_columns)]
+        if len(clauses) == 1:
+            return clauses[0]
+        return and_(*clauses)
+
+    def shortest_path(self, start, end, removed_nodes=(), removed_edges=()):
+        """Find the shortest path of tables between two tables.
+
+        This is a breadth first search over the foreign keys, run from both
+        ends at once so only a small part of a large schema is visited.  Nodes
+        and (from, to) edges can be left out of the search.  The path
+        includes both ends, None is returned if there isn't one.
+
+        """
+        if start == end:
+            return [start]
+        forward = {start: None}
+        backward = {end: None}
+        forward_queue = [start]
+        backward_queue = [end]
+        while forward_queue and backward_queue:
+            if len(forward_queue) <= len(backward_queue):
+                meet, forward_queue = self._expand(
+                    forward_queue, forward, backward, removed_nodes,
+                    removed_edges, False)
+            else:
+                meet, backward_queue = self._expand(
+                    backward_queue, backward, forward, removed_nodes,
+                    removed_edges, True)
+            if meet is not None:
+                path = []
+                name = meet
+                while name is not None:
+                    path.append(name)
+                    name = forward[name]
+                path.reverse()
+                name = backward[meet]
+                while name is not None:
+                    path.append(name)
+                    name = backward[name]
+                return path
+        return None
+
+    def _expand(self, queue, seen, other, removed_nodes, removed_edges,
+                reverse):
+        """Expand one level of a breadth first search.
+
+        Returns the node where the search met the other side, if it did, and
+        the next level to expand.
+
+        """
+        following = []
+        for name in queue:
+            for neighbour in self.adjacency.get(name, ()):
+                if neighbour in seen or neighbour in removed_nodes:
+                    continue
+                edge = (neighbour, name) if reverse else (name, neighbour)
+                if edge in removed_edges:
+                    continue
+                seen[neighbour] = name
+                if neighbour in other:
+                    return neighbour, following
+                following.append(neighbour)
+        return None, following
+
+    def shortest_paths(self, start, end, k=1):
+        """Find the k shortest paths between two tables.
+
+        Paths are found with Yen's algorithm, each one is a list of table
+        names from start to end.  Fewer than k paths are returned if that is
+        all there is.
+
+        """
+        first = self.shortest_path(start, end)
+        if first is None:
+            return []
+        paths = [first]
+        candidates = []
+        while len(paths) < k:
+            last = paths[-1]
+            for i in range(len(last) - 1):
+                root = last[:i + 1]
+                removed_edges = set((x[i], x[i + 1]) for x in paths
+                                    if len(x) > i + 1 and x[:i + 1] == root)
+                removed_nodes = set(root[:-1])
+                spur = self.shortest_path(root[-1], end, removed_nodes,
+                                          removed_edges)
+                if spur is None:
+                    continue
+                path = root[:-1] + spur
+                if path not in paths and path not in candidates:
+                    candidates.append(path)
+            if not candidates:
+                break
+            candidates.sort(key=len)
+            paths.append(candidates.pop(0))
+        return paths
@@ -1,77 +1,306 @@
+from itertools import islice, izip
+
 from PyQt4.QtGui import (QWidget, QHBoxLayout, QVBoxLayout, QLineEdit, QLabel,
-                         QCheckBox, QListWidget, QListWidgetItem)
-from PyQt4.QtCore import pyqtSignal
+                         QCheckBox, QListView)
+from PyQt4.QtCore import (Qt, QAbstractListModel, QModelIndex, QThread,
+                          QVariant, pyqtSignal)
+
+from search import SearchIndex
+
+
+def in_order(names):
+    return all(a < b for a, b in izip(names, islice(names, 1, None)))
 
 
 class Filter(QWidget):
-    """Abstract base class for filters."""
+    """Abstract base class for filters.
+
+    A filter selects the names that pass it from a list in a single pass.
+    It remembers what it last selected with, so it can tell when its new
+    settings only narrow down the names that passed before.
+
+    """
     filter_changed = pyqtSignal()
 
+    def select(self, names):
+        """Get the names that pass the filter."""
+        raise NotImplementedError
+
+    def narrowing(self):
+        """Check if the filter only drops names since the last select."""
+        return False
+
+
+class TableListModel(QAbstractListModel):
+    """The table names of a join list, less those that are filtered out.
+
+    This stands in for a filter proxy over the sorted names.  The visible
+    names are replaced as a whole, and only the rows that appear or
+    disappear are inserted or removed, so the view doesn't have to look at
+    rows that stay the same.  Names ranked by a search come in their own
+    order, the rows are then moved into place with a layout change.
+
+    """
+
+    # with more runs of changed rows than this the model is reset instead
+    reset_runs = 64
+
+    def __init__(self, names, parent=None):
+        """Initialize model with every name visible."""
+        QAbstractListModel.__init__(self, parent)
+        self.names = sorted(names)
+        self.visible = list(self.names)
+        self.ordered = True
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.visible)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or role != Qt.DisplayRole:
+            return QVariant()
+        return QVariant(self.visible[index.row()])
+
+    def flags(self, index):
+        if not index.isValid():
+            return Qt.NoItemFlags
+        return Qt.ItemIsEnabled | Qt.ItemIsSelectable | Qt.ItemIsDragEnabled
+
+    def set_visible(self, names):
+        """Show just these names, in the order given."""
+        ordered = in_order(names)
+        if ordered and self.ordered:
+            runs = self.changes(self.visible, names)
+        else:
+            runs = self.membership_changes(self.visible, names)
+        self.ordered = ordered
+        if len(runs) > self.reset_runs:
+            self.beginResetModel()
+            self.visible = list(names)
+            self.endResetModel()
+            return
+
+        for row, removed, inserted in runs:
+            if removed:
+                self.beginRemoveRows(QModelIndex(), row, row + removed - 1)
+                del self.visible[row:row + removed]
+                self.endRemoveRows()
+            if inserted:
+                self.beginInsertRows(QModelIndex(), row,
+                                     row + len(inserted) - 1)
+                self.visible[row:row] = inserted
+                self.endInsertRows()
+        if self.visible != names:
+            self.reorder(names)
+
+    def reorder(self, names):
+        """Move the rows into the order of the names, which are the same."""
+        self.layoutAboutToBeChanged.emit()
+        rows = dict((x, i) for i, x in enumerate(names))
+        old = self.persistentIndexList()
+        new = [self.index(rows[self.visible[x.row()]]) for x in old]
+        self.changePersistentIndexList(old, new)
+        self.visible = list(names)
+        self.layoutChanged.emit()
+
+    @staticmethod
+    def changes(old, new):
+        """Get the runs of rows that change going from old to new.
+
+        Both lists are sorted, so they are walked together once.  Each run is
+        the row it starts at, the number of rows removed there and the names
+        inserted in their place.  Rows are numbered as they will be once the
+        earlier runs have been applied.
+
+        """
+        runs = []
+        i = j = row = 0
+        while i < len(old) or j < len(new):
+            if i < len(old) and j < len(new) and old[i] == new[j]:
+                i += 1
+                j += 1
+                row += 1
+                continue
+            start_i, start_j = i, j
+            while i < len(old) and (j == len(new) or old[i] < new[j]):
+                i += 1
+            while j < len(new) and (i == len(old) or new[j] < old[i]):
+                j += 1
+            runs.append((row, i - start_i, new[start_j:j]))
+            row += j - start_j
+        return runs
+
+    @staticmethod
+    def membership_changes(old, new):
+        """Get the runs of rows removed from old and those added to new.
+
+        The runs are the same as for changes, but the order of the names is
+        ignored.  Names in new but not old are added at the end.
+
+        """
+        runs = []
+        keep = set(new)
+        row = 0
+        i = 0
+        while i < len(old):
+            if old[i] in keep:
+                i += 1
+                row += 1
+                continue
+            start = i
+            while i < len(old) and old[i] not in keep:
+                i += 1
+            runs.append((row, i - start, []))
+        present = set(old)
+        added = [x for x in new if x not in present]
+        if added:
+            runs.append((len(keep) - len(added), 0, added))
+        return runs
+
 
 class ListFilter(object):
     """Handle filtering a list from multiple filters.
 
-    Each filter needs to inherit from Filter.  Whenever the changed signal is
-    sent the filter will refilter the entire list.
+    Each filter needs to inherit from Filter.  When a filter changes the
+    filters are applied to the names in one pass.  If the changed filter
+    only narrows what it selects, just the names still visible are run
+    through it.
 
     """
 
-    def __init__(self, list_component, filters):
-        """Filtering of a list component."""
-        self.list = list_component
+    def __init__(self, model, filters):
+        """Filtering of a table list model."""
+        self.model = model
         self.filters = filters
         for f in filters:
-            f.filter_changed.connect(self.filter)
+            f.filter_changed.connect(lambda f=f: self.filter(f))
 
-    def filter(self):
+    def filter(self, changed=None):
         """Filter the configured list."""
-        count = 0
-        while count < self.list.count():
-            item = self.list.item(count)
-            text = item.text()
-
-            # ask the filters if this item should be filtered
-            visible = True
+        if changed is not None and changed.narrowing():
+            names = changed.select(self.model.visible)
+        else:
+            names = self.model.names
             for f in self.filters:
-                visible = visible and not f.filter_item(text)
+                names = f.select(names)
+        self.model.set_visible(names)
 
-            item.setHidden(not visible)
-            count += 1
+
+class ColumnIndexThread(QThread):
+    """Load the column names and index them away from the gui thread.
+
+    The index is left in result, for SearchIndex.use_columns.
+
+    """
+
+    def __init__(self, index, load_columns):
+        QThread.__init__(self)
+        self.index = index
+        self.load_columns = load_columns
+        self.result = None
+        self.error = None
+
+    def run(self):
+        try:
+            self.result = self.index.index_columns(self.load_columns())
+        except Exception as e:
+            self.error = e
 
 
 class TextFilter(Filter):
-    """Handle filtering of a list by matching subsequence."""
+    """Handle filtering of a list by matching subsequence.
+
+    The best matches are listed first.  If there is a way to get the column
+    names of the tables they can be searched as well, they are only loaded
+    and indexed once asked for, in the background.  Until then only the
+    table names are searched.
+
+    """
 
-    def __init__(self):
+    def __init__(self, names, columns=None):
         """Create qt widget and attach handlers."""
         QWidget.__init__(self)
+        self.names = names
+        self.load_columns = columns
+        self.index = None
+        self.column_thread = None
         hbox = QHBoxLayout()
         hbox.setContentsMargins(0, 0, 0, 0)
         self.edit = QLineEdit()
         self.label = QLabel('Filter:')
+        self.columns = QCheckBox('Columns')
         hbox.addWidget(self.label)
         hbox.addWidget(self.edit)
+        hbox.addWidget(self.columns)
+        self.columns.setVisible(columns is not None)
         self.setLayout(hbox)
+        self.applied = ('', False)
         self.edit.textChanged.connect(self.filter_changed)
-
-    def filter_item(self, list_item):
-        """Filter an item if it doesn't include a subsequence of the text."""
+        self.columns.stateChanged.connect(self.filter_changed)
+
+    def search_index(self):
+        """Get the search index, building it the first time."""
+        if self.index is None:
+            self.index = SearchIndex(self.names)
+        if self.columns.isChecked() and self.index.columns is None:
+            self.index_columns()
+        return self.index
+
+    def index_columns(self):
+        """Start indexing the column names, unless it has started already."""
+        if self.column_thread is not None:
+            return
+        thread = ColumnIndexThread(self.index, self.load_columns)
+        thread.finished.connect(self.columns_indexed)
+        self.column_thread = thread
+        self.columns.setText('Columns (indexing)')
+        thread.start(QThread.LowPriority)
+
+    def columns_indexed(self):
+        thread, self.column_thread = self.column_thread, None
+        self.columns.setText('Columns')
+        if thread.error is not None:
+            self.columns.setToolTip(
+                'Column names failed to load: {0}'.format(thread.error))
+            self.columns.setChecked(False)
+            return
+        self.index.use_columns(thread.result)
+        if self.columns.isChecked():
+            self.filter_changed.emit()
+
+    def searching_columns(self):
+        """Check if the column names are searched, not just asked for."""
+        return self.columns.isChecked() and self.index is not None and \
+            self.index.columns is not None
+
+    def select(self, names):
+        """Keep the names matching the text, best first."""
         text = str(self.edit.text())
-        if text is '':
-            return False
-        return text not in str(list_item)
-
-
-class FkFilter(QWidget):
+        if text or self.columns.isChecked():
+            # checking the box starts indexing before anything is typed
+            self.search_index()
+        columns = self.searching_columns()
+        self.applied = (text, columns)
+        if not text:
+            return list(names)
+        return self.index.search(text, names, columns)
+
+    def narrowing(self):
+        # anything matching the new text matches the old text as well
+        text, columns = self.applied
+        return columns == self.searching_columns() and \
+            text.lower() in str(self.edit.text()).lower()
+
+
+class FkFilter(Filter):
     """Handle filtering of a list by matching foreign keys of the input."""
 
-    filter_changed = pyqtSignal()
-
-    def __init__(self, meta):
+    def __init__(self, schema):
         """Create qt widget and attach handlers."""
         QWidget.__init__(self)
 
-        self.meta = meta
+        self.schema = schema
 
         hbox = QHBoxLayout()
         hbox.setContentsMargins(0, 0, 0, 0)
@@ -84,9 +313,9 @@ class FkFilter(QWidget):
         self.setLayout(hbox)
         self.checkbox.setChecked(True)
         # self.checkbox.setTristate(True)
+        self.applied = None
 
         # when the text is changed, run the filter
-        self.edit.textChanged.connect(self.filter_changed)
         self.edit.textChanged.connect(self.reset)
         self.checkbox.stateChanged.connect(self.filter_changed)
 
@@ -95,27 +324,33 @@ class FkFilter(QWidget):
             del self._fks
         self.filter_changed.emit()
 
-    def filter_item(self, list_item):
-        """Filter an item if it isn't a foreign key of the input."""
+    def allowed(self):
+        """Get the names that pass, None when they all do."""
         if self.checkbox.isChecked():
-            return str(list_item) not in self.fks()
-        else:
-            return False
+            return self.fks()
+        return None
+
+    def select(self, names):
+        """Keep the names that are foreign keys of the input."""
+        allowed = self.applied = self.allowed()
+        if allowed is None:
+            return list(names)
+        return [x for x in names if x in allowed]
+
+    def narrowing(self):
+        allowed = self.allowed()
+        if self.applied is None:
+            return True
+        return allowed is not None and allowed <= self.applied
 
     def fks(self):
         if not hasattr(self, '_fks'):
             name = str(self.edit.text())
-            table = self.meta.tables.get(name)
-            if table is not None:
-                connects_to = (fk.column.table.name for fk in table.foreign_keys)
-                connected_to = (t.name for t in self.meta.tables.itervalues()
-                                for fk in t.foreign_keys if fk.column.table is table)
-                fks = set()
-                fks.update(connects_to)
-                fks.update(connected_to)
-                self._fks = fks
+            graph = self.schema.graph
+            if name in graph.names:
+                self._fks = graph.neighbours(name)
             else:
-                self._fks = set(self.meta.tables.keys())
+                self._fks = graph.names
         return self._fks
 
 
@@ -127,19 +362,22 @@ class JoinList(QWidget):
 
     """
 
-    def __init__(self, items, meta):
+    def __init__(self, items, schema):
         """Initialize object."""
         QWidget.__init__(self)
 
         # create list
-        self.list = QListWidget()
+        self.model = TableListModel(items)
+        self.list = QListView()
+        self.list.setModel(self.model)
         self.list.setDragEnabled(True)
+        self.list.setUniformItemSizes(True)
 
         # add filters
-        self.text_filter = TextFilter()
-        self.fk_filter = FkFilter(meta)
+        self.text_filter = TextFilter(self.model.names, schema.column_names)
+        self.fk_filter = FkFilter(schema)
 
-        self.list_filter = ListFilter(self.list, [self.text_filter, self.fk_filter])
+        self.list_filter = ListFilter(self.model, [self.text_filter, self.fk_filter])
 
         # # set vertical layout
         vlayout = QVBoxLayout()
@@ -147,9 +385,6 @@ class JoinList(QWidget):
         vlayout.addWidget(self.list)
         vlayout.addWidget(self.fk_filter)
 
-        for item in reversed([QListWidgetItem(x) for x in sorted(items)]):
-            self.list.insertItem(0, item)
-
         self.setLayout(vlayout)
 
     def set_table(self, table):
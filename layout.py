@@ -0,0 +1,349 @@
+import time
+
+import numpy as np
+
+
+class LayoutEngine(object):
+    """Force directed layout of the tables in a scene.
+
+    Positions, velocities and masses of the nodes are kept in arrays so that
+    each step of the simulation is a handful of vectorized operations.  Nodes
+    repel each other like charges and edges pull them together like springs.
+
+    Small graphs compute the repulsion between every pair of nodes directly.
+    Larger graphs use a Barnes-Hut quadtree, where groups of nodes far enough
+    away are treated as a single node at their center.
+
+    The layout is incremental.  Only active nodes are simulated, a node is
+    frozen once it has settled and woken again when a node it is connected
+    to moves quickly.  Frozen nodes still push active nodes away.
+
+    A step of a large graph can take longer than a frame, so steps are done
+    in small pieces that run can spread over several calls.
+
+    """
+
+    repulsion = 600.0
+    spring_constant = 100.0
+    spring_length = 1.0
+    damping = 0.5
+    timestep = 0.05
+    # nodes that move less than this are left where they are drawn
+    move_tolerance = 1e-3
+    # nodes with less kinetic energy than this are frozen
+    freeze_energy = 1e-3
+    # nodes with more kinetic energy than this wake up their neighbours
+    wake_energy = 0.1
+
+    # use barnes-hut when there are more nodes than this
+    barnes_hut_threshold = 200
+    # a group of nodes is used when its size / distance is below theta
+    theta = 0.8
+    # quadtree leaves hold up to this many nodes
+    leaf_size = 16
+    # stop splitting the quadtree at this depth, for nodes on top of each other
+    max_depth = 24
+
+    def __init__(self):
+        """Initialize an empty layout."""
+        self.clear()
+
+    def clear(self):
+        # the step in progress, a generator of its pieces
+        self.pending = None
+        self.energy = 0.0
+        self.positions = np.zeros((0, 2))
+        self.velocities = np.zeros((0, 2))
+        self.masses = np.zeros(0)
+        self.edges = np.zeros((0, 2), dtype=int)
+        self.active = np.zeros(0, dtype=bool)
+        # where each node was last drawn, inf until it is drawn
+        self.drawn = np.zeros((0, 2))
+
+    def __len__(self):
+        return len(self.masses)
+
+    def add_node(self, x, y, mass=1.0):
+        """Add a node, returning its index."""
+        self.pending = None
+        self.positions = np.vstack([self.positions, [x, y]])
+        self.velocities = np.vstack([self.velocities, [0.0, 0.0]])
+        self.masses = np.append(self.masses, mass)
+        self.active = np.append(self.active, True)
+        self.drawn = np.vstack([self.drawn, [np.inf, np.inf]])
+        return len(self.masses) - 1
+
+    def add_nodes(self, positions, masses, active=True):
+        """Add many nodes at once, returning their indexes.
+
+        Inactive nodes are taken to be drawn where they are already, so they
+        stay put until something wakes them.
+
+        """
+        self.pending = None
+        positions = np.asarray(positions, dtype=float).reshape(-1, 2)
+        start = len(self.masses)
+        self.positions = np.vstack([self.positions, positions])
+        self.velocities = np.vstack([self.velocities,
+                                     np.zeros_like(positions)])
+        self.masses = np.append(self.masses, masses)
+        self.active = np.append(self.active,
+                                np.repeat(bool(active), len(positions)))
+        if active:
+            drawn = np.full_like(positions, np.inf)
+        else:
+            drawn = positions.copy()
+        self.drawn = np.vstack([self.drawn, drawn])
+        return range(start, len(self.masses))
+
+    def add_edge(self, from_index, to_index):
+        self.pending = None
+        self.edges = np.vstack([self.edges, [from_index, to_index]])
+
+    def add_edges(self, edges):
+        self.pending = None
+        edges = np.asarray(edges, dtype=int).reshape(-1, 2)
+        self.edges = np.vstack([self.edges, edges])
+
+    def position(self, index):
+        return self.positions[index]
+
+    def set_position(self, index, x, y):
+        self.pending = None
+        self.positions[index] = (x, y)
+        self.velocities[index] = 0.0
+        self.drawn[index] = np.inf
+
+    def wake(self, indexes):
+        """Start simulating the given nodes again."""
+        self.active[indexes] = True
+
+    def is_active(self):
+        return self.pending is not None or bool(self.active.any())
+
+    def run(self, deadline):
+        """Simulate until the deadline, a time.time(), or the layout settles.
+
+        Work stops between the pieces of a step, the step is picked up where
+        it was left by the next call.  At least one piece is done each call.
+        Returns the number of steps finished.
+
+        """
+        steps = 0
+        while self.is_active():
+            if self.pending is None:
+                self.pending = self.step_pieces()
+            for piece in self.pending:
+                if time.time() > deadline:
+                    return steps
+            self.pending = None
+            steps += 1
+        return steps
+
+    def step(self):
+        """Run a whole step at once, returning the kinetic energy."""
+        self.pending = None
+        for piece in self.step_pieces():
+            pass
+        return self.energy
+
+    def step_pieces(self):
+        """Advance the simulation one step, yielding between its pieces.
+
+        Only active nodes are moved.  The ones that settle are frozen and the
+        neighbours of the ones still moving are woken up.  The kinetic energy
+        is left in energy.
+
+        """
+        self.energy = 0.0
+        active = np.flatnonzero(self.active)
+        if not len(active):
+            return
+        forces = np.zeros_like(self.positions)
+        for piece in self.repulsion_pieces(active, forces):
+            yield
+        forces = forces[active] + self.spring_forces()[active]
+        yield
+        forces /= self.masses[active][:, np.newaxis]
+        velocities = (self.velocities[active] + forces * self.timestep) * \
+            self.damping
+        self.velocities[active] = velocities
+        self.positions[active] += velocities * self.timestep
+
+        energy = (velocities ** 2).sum(axis=1)
+        settled = active[energy < self.freeze_energy]
+        self.active[settled] = False
+        self.velocities[settled] = 0.0
+
+        moving = np.zeros(len(self), dtype=bool)
+        moving[active[energy >= self.wake_energy]] = True
+        if len(self.edges) and moving.any():
+            source, target = self.edges[:, 0], self.edges[:, 1]
+            self.active[target[moving[source]]] = True
+            self.active[source[moving[target]]] = True
+        self.energy = float(energy.sum())
+
+    def moved_nodes(self):
+        """Get the nodes that moved noticeably since they were last drawn.
+
+        The nodes returned are taken to be drawn.  The others keep their drawn
+        position so that small movements add up until they are worth drawing.
+
+        """
+        delta = np.abs(self.positions - self.drawn).max(axis=1)
+        moved = delta > self.move_tolerance
+        self.drawn[moved] = self.positions[moved]
+        return moved
+
+    def spring_forces(self):
+        """Get the force of every spring (Hooke's law) on each node."""
+        forces = np.zeros_like(self.positions)
+        if not len(self.edges):
+            return forces
+        source, target = self.edges[:, 0], self.edges[:, 1]
+        d = self.positions[target] - self.positions[source]
+        distance = np.sqrt((d ** 2).sum(axis=1))
+        distance = np.maximum(distance, 1e-9)
+        displacement = self.spring_length - distance
+        force = d / distance[:, np.newaxis] * \
+            (self.spring_constant * displacement * 0.5)[:, np.newaxis]
+        np.add.at(forces, target, force)
+        np.subtract.at(forces, source, force)
+        return forces
+
+    def repulsion_forces(self, bodies):
+        """Get the force of every other node (Coulomb's law) on the bodies."""
+        forces = np.zeros_like(self.positions)
+        for piece in self.repulsion_pieces(bodies, forces):
+            pass
+        return forces[bodies]
+
+    def repulsion_pieces(self, bodies, forces):
+        """Add the repulsion on the bodies to forces, a piece at a time."""
+        if len(self) > self.barnes_hut_threshold:
+            return self.barnes_hut_pieces(bodies, forces)
+        return self.direct_pieces(bodies, forces)
+
+    def _kernel(self, d, charge=1.0):
+        """Repulsion for displacements d, from charges of the given size.
+
+        The old pairwise loop applied the force of each pair twice, and with
+        half the squared distance, so the constant is four times the
+        repulsion to keep layouts looking the same.
+
+        """
+        distance = np.sqrt((d ** 2).sum(axis=-1))
+        safe = np.where(distance > 0, distance, 1.0)
+        scale = 4.0 * self.repulsion * charge / \
+            (safe * (distance + 1.0) ** 2)
+        scale = np.where(distance > 0, scale, 0.0)
+        return d * scale[..., np.newaxis]
+
+    # bodies the direct repulsion is worked out for in a piece
+    direct_chunk = 64
+
+    def direct_pieces(self, bodies, forces):
+        """Repulsion from every node, O(n) per body but vectorized."""
+        positions = self.positions
+        for i in range(0, len(bodies), self.direct_chunk):
+            chunk = bodies[i:i + self.direct_chunk]
+            d = positions[chunk][:, np.newaxis, :] - \
+                positions[np.newaxis, :, :]
+            forces[chunk] += self._kernel(d).sum(axis=1)
+            yield
+
+    def barnes_hut_pieces(self, bodies, forces):
+        """Repulsion approximated with a quadtree, O(log n) per body.
+
+        Each node of the tree is a piece, while it is built and while the
+        forces are added up.
+
+        """
+        positions = self.positions
+        tree = QuadTree(positions, self.leaf_size, self.max_depth)
+        for piece in tree.build():
+            yield
+
+        stack = [(0, np.asarray(bodies))]
+        while stack:
+            node, near = stack.pop()
+            if not len(near):
+                continue
+            yield
+            members = tree.members[node]
+            if members is not None:
+                d = positions[near][:, np.newaxis, :] - \
+                    positions[members][np.newaxis, :, :]
+                forces[near] += self._kernel(d).sum(axis=1)
+                continue
+
+            d = positions[near] - tree.centers[node]
+            distance = np.sqrt((d ** 2).sum(axis=1))
+            far = tree.sizes[node] < self.theta * distance
+            if far.any():
+                forces[near[far]] += self._kernel(d[far], tree.counts[node])
+            near = near[~far]
+            for child in tree.children[node]:
+                stack.append((child, near))
+
+
+class QuadTree(object):
+    """Quadtree over a set of points for Barnes-Hut.
+
+    Nodes are kept in parallel lists.  Each node has the center and count of
+    the points below it, its size and either its children or, for leaves,
+    the indexes of its points.
+
+    """
+
+    def __init__(self, positions, leaf_size, max_depth):
+        """Initialize the tree, build has to run before it is used."""
+        self.positions = positions
+        self.leaf_size = leaf_size
+        self.max_depth = max_depth
+        self.centers = []
+        self.counts = []
+        self.sizes = []
+        self.children = []
+        self.members = []
+
+    def build(self):
+        """Build the tree, yielding after each node.
+
+        The root is node 0, children are added after their parents.
+
+        """
+        positions = self.positions
+        low = positions.min(axis=0)
+        high = positions.max(axis=0)
+        size = max(float((high - low).max()), 1e-9)
+        stack = [(np.arange(len(positions)), low, size, 0, None)]
+        while stack:
+            indexes, low, size, depth, parent = stack.pop()
+            node = len(self.centers)
+            if parent is not None:
+                self.children[parent].append(node)
+            points = positions[indexes]
+            self.centers.append(points.mean(axis=0))
+            self.counts.append(len(indexes))
+            self.sizes.append(size)
+            self.children.append([])
+            if len(indexes) <= self.leaf_size or depth >= self.max_depth:
+                self.members.append(indexes)
+                yield
+                continue
+            self.members.append(None)
+
+            half = size / 2.0
+            middle = low + half
+            right = points[:, 0] >= middle[0]
+            bottom = points[:, 1] >= middle[1]
+            for x_side in (False, True):
+                for y_side in (False, True):
+                    mask = (right == x_side) & (bottom == y_side)
+                    if not mask.any():
+                        continue
+                    corner = low + np.array([half * x_side, half * y_side])
+                    stack.append((indexes[mask], corner, half, depth + 1,
+                                  node))
+            yield
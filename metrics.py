@@ -0,0 +1,112 @@
+import os
+import json
+import time
+from collections import deque, OrderedDict
+from contextlib import contextmanager
+
+
+class QueryTiming(object):
+    """How long each phase of running a query took.
+
+    The phases are added as they happen: build and compile in the scene,
+    connect, execute and fetch on the worker thread and populate when the
+    results are put in the table.  Phases that were skipped, such as
+    building a query that was cached, are left out.
+
+    """
+
+    def __init__(self, sql=''):
+        """Initialize a timing with no phases."""
+        self.sql = sql
+        self.created = time.time()
+        self.phases = OrderedDict()
+        self.rows = 0
+        self.bytes = 0
+        self.cached = False
+
+    def add(self, phase, seconds):
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+    @contextmanager
+    def phase(self, phase):
+        """Time the body of a with statement as a phase."""
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add(phase, time.time() - start)
+
+    def total(self):
+        return sum(self.phases.values())
+
+    def summary(self):
+        """Get a single line description for the status bar."""
+        parts = ['{0} {1:.1f} ms'.format(name, seconds * 1000)
+                 for name, seconds in self.phases.items()]
+        parts.append('{0} rows'.format(self.rows))
+        if self.bytes:
+            parts.append('{0:.1f} kB'.format(self.bytes / 1024.0))
+        if self.cached:
+            parts.append('cached')
+        return 'total {0:.1f} ms: {1}'.format(self.total() * 1000,
+                                              ', '.join(parts))
+
+    def as_dict(self):
+        return {'time': self.created,
+                'sql': self.sql,
+                'phases': dict(self.phases),
+                'total': self.total(),
+                'rows': self.rows,
+                'bytes': self.bytes,
+                'cached': self.cached}
+
+
+class Metrics(object):
+    """A rolling history of query timings.
+
+    If there is a log file each timing is also appended to it as a line of
+    JSON, along with the SQL of the query.
+
+    """
+
+    # timings kept in memory
+    history = 100
+
+    def __init__(self, path=None, history=None):
+        """Initialize an empty history."""
+        if history is not None:
+            self.history = history
+        self.path = path and os.path.expanduser(path)
+        self.timings = deque(maxlen=self.history)
+
+    def __len__(self):
+        return len(self.timings)
+
+    def record(self, timing):
+        """Add a timing to the history and the log."""
+        self.timings.append(timing)
+        if not self.path:
+            return
+        try:
+            with open(self.path, 'a') as f:
+                f.write(json.dumps(timing.as_dict()) + '\n')
+        except (IOError, OSError):
+            pass
+
+    def averages(self):
+        """Get the mean time of each phase over the history."""
+        totals = OrderedDict()
+        counts = {}
+        for timing in self.timings:
+            for name, seconds in timing.phases.items():
+                totals[name] = totals.get(name, 0.0) + seconds
+                counts[name] = counts.get(name, 0) + 1
+        return OrderedDict((name, totals[name] / counts[name])
+                           for name in totals)
+
+    def summary(self):
+        """Describe the average phases of the queries in the history."""
+        parts = ['{0} {1:.1f} ms'.format(name, seconds * 1000)
+                 for name, seconds in self.averages().items()]
+        return 'Average of {0} queries: {1}'.format(len(self),
+                                                   ', '.join(parts))
@@ -0,0 +1,108 @@
+from sqlalchemy import and_, or_
+from sqlalchemy.sql import visitors
+
+
+def unique_columns(condition, table):
+    """Check if a join condition matches at most one row of the table.
+
+    This is true when the condition covers the whole primary key of the
+    table, for example when joining along a foreign key that points at it.
+
+    """
+    if condition is None:
+        return False
+    primary = set(table.primary_key)
+    if not primary:
+        return False
+    used = set(x for x in visitors.iterate(condition, {})
+               if getattr(x, 'table', None) is table)
+    return primary <= used
+
+
+def after(columns, values):
+    """Condition for rows sorting after the given key.
+
+    Composite keys are expanded instead of using a row comparison so that
+    every database can use the index.
+
+    """
+    clauses = []
+    for i, column in enumerate(columns):
+        equal = [columns[j] == values[j] for j in range(i)]
+        clauses.append(and_(*(equal + [column > values[i]])))
+    if len(clauses) == 1:
+        return clauses[0]
+    return or_(*clauses)
+
+
+class Pager(object):
+    """Keep track of the current page of a query.
+
+    When the query has a unique key, pages are found by seeking past the last
+    key of the previous page (keyset pagination).  Each page then costs the
+    same no matter how deep it is.  Without one it falls back to limit and
+    offset.
+
+    """
+
+    page_size = 100
+
+    def __init__(self, page_size=None):
+        """Initialize pager at the first page."""
+        if page_size is not None:
+            self.page_size = page_size
+        self.reset()
+
+    def reset(self):
+        """Go back to the first page and forget the known keys."""
+        self.page = 0
+        self.starts = [None]
+
+    def set_page_size(self, page_size):
+        self.page_size = page_size
+        self.reset()
+
+    def apply(self, query, key_columns=None, order_columns=None):
+        """Restrict the query to the current page.
+
+        The key columns must uniquely identify the rows of the query for
+        keyset pagination, pass None to use offsets.  Offsets are only
+        stable between pages when the rows are sorted, by the order columns.
+
+        """
+        if key_columns:
+            query = query.order_by(*key_columns)
+            start = self.starts[self.page]
+            if start is not None:
+                query = query.where(after(key_columns, start))
+            return query.limit(self.page_size)
+
+        if order_columns:
+            query = query.order_by(*order_columns)
+        query = query.limit(self.page_size)
+        if self.page:
+            query = query.offset(self.page * self.page_size)
+        return query
+
+    def key(self):
+        """Get a hashable summary of the current page."""
+        return self.page_size, self.page, self.starts[self.page]
+
+    def has_previous(self):
+        return self.page > 0
+
+    def next_page(self, last_key=None):
+        """Move to the next page.
+
+        For keyset pagination this needs the key of the last row of the
+        current page.
+
+        """
+        self.page += 1
+        del self.starts[self.page:]
+        self.starts.append(last_key)
+
+    def previous_page(self):
+        """Move to the previous page."""
+        if self.page > 0:
+            self.page -= 1
@@ -0,0 +1,105 @@
+from PyQt4.QtCore import QObject, QThread
+
+from cache import result_key
+from metrics import QueryTiming
+from runner import QueryThread
+
+
+class PrefetchGuard(object):
+    """Hold every query the cost guard would, and those of unknown cost.
+
+    Prefetched results are shown without asking once the query comes up,
+    so nobody gets to confirm a costly one.
+
+    """
+
+    def __init__(self, guard):
+        self.guard = guard
+        self.plans = guard.plans
+
+    def holds(self, plan):
+        if plan is None or plan.estimate is None:
+            return True
+        return self.guard.holds(plan)
+
+
+class Prefetcher(QObject):
+    """Run queries the user is likely to want next, caching their results.
+
+    Only a few queries run at once, at low priority, and each is dropped
+    unless it fetches its whole result in the first batch.  Results go into
+    the result cache of the runner, from the gui thread, so the runner finds
+    them there when the query comes up.
+
+    With a cost guard each query is explained first, and only run when its
+    cost is known and the guard wouldn't hold it.
+
+    """
+
+    # queries run at once
+    max_running = 2
+
+    def __init__(self, engine, cache, guard=None, parent=None):
+        """Initialize prefetcher with nothing to run."""
+        QObject.__init__(self, parent)
+        self.engine = engine
+        self.cache = cache
+        self.guard = None
+        if guard is not None:
+            self.guard = PrefetchGuard(guard)
+        self.pending = []
+        self.running = set()
+        self.generation = 0
+
+    def start(self, queries):
+        """Cancel what is being prefetched and prefetch these instead.
+
+        Queries that are cached already are skipped.
+
+        """
+        self.cancel()
+        self.pending = [x for x in queries
+                        if self.cache.get(result_key(x)) is None and
+                        not self.known_held(x)]
+        self.fill()
+
+    def known_held(self, query):
+        """Check if the plan of a query is known to be held."""
+        if self.guard is None:
+            return False
+        plan = self.guard.plans.get(str(query))
+        return plan is not None and self.guard.holds(plan)
+
+    def fill(self):
+        """Start pending queries until the running ones are at the cap."""
+        while self.pending and len(self.running) < self.max_running:
+            query = self.pending.pop(0)
+            thread = QueryThread(self.engine, query, self.generation,
+                                 QueryTiming(str(query)), self.guard)
+            thread.finished.connect(lambda thread=thread:
+                                    self.on_finished(thread))
+            self.running.add(thread)
+            thread.start(QThread.LowPriority)
+
+    def cancel(self):
+        """Stop prefetching, running queries are interrupted."""
+        self.generation += 1
+        self.pending = []
+        for thread in self.running:
+            thread.cancel()
+
+    def is_running(self):
+        return bool(self.pending or self.running)
+
+    def on_finished(self, thread):
+        """Cache the results of a thread and start the next query."""
+        self.running.discard(thread)
+        stale = thread.cancelled or thread.generation != self.generation
+        if thread.plan is not None:
+            self.guard.plans.put(thread.plan)
+        if not stale and not thread.held and thread.error is None and \
+                thread.cursor is None:
+            self.cache.put(result_key(thread.query), thread.keys,
+                           thread.rows)
+        thread.close()
+        self.fill()
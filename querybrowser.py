@@ -2,35 +2,90 @@
 import sys
 
 from PyQt4.QtGui import *
-from PyQt4.QtCore import Qt
-from sqlalchemy import create_engine, MetaData
+from PyQt4.QtCore import Qt, QThread, QTimer
 
+from cache import result_size
+from config import Database, parse_args
+from constraints import constraint_error
+from constraintthread import ConstraintThread
+from export import ExportThread, formats
 from joinlist import JoinList
+from metrics import Metrics
+from prefetch import Prefetcher
+from results import ResultModel
+from runner import QueryRunner, QueryThread
 from scene import Scene
+from scenefile import read_scene, write_scene
+from statsthread import StatsThread
 
-engine = create_engine('mysql://root@localhost/veracity', pool_recycle=3600)
-meta = MetaData()
-meta.reflect(bind=engine)
+# open windows, by database name
+windows = {}
+# every configured database, by name
+databases = {}
 
 
 class MainWindow(QMainWindow):
     """The main application window."""
 
-    def __init__(self):
+    # milliseconds to wait after the constraints are edited before querying
+    constraint_delay = 500
+    # milliseconds to wait after results are shown before prefetching
+    prefetch_delay = 1000
+    # neighbouring tables prefetched, from the top of the join list
+    prefetch_tables = 4
+
+    def __init__(self, database):
         """Initialize."""
         QMainWindow.__init__(self)
+        self.database = database
+        self.schema = schema = database.schema
+        self.setWindowTitle('Query Browser - {0}'.format(database.name))
 
         # graphics view
-        self.scene = Scene()
+        self.scene = Scene(schema)
         graph = QGraphicsView(self.scene)
         self.scene.query_changed.connect(self.query_change)
         self.scene.table_changed.connect(self.table_change)
 
+        # queries run on worker threads
+        self.result_cache = database.result_cache()
+        self.runner = QueryRunner(schema.engine, self.result_cache,
+                                  database.cost_guard())
+        self.runner.results_ready.connect(self.show_results)
+        self.runner.query_failed.connect(self.show_error)
+        self.runner.plan_ready.connect(self.show_plan)
+        self.runner.query_held.connect(self.query_held)
+        self.prefetcher = Prefetcher(schema.engine, self.result_cache,
+                                     self.runner.guard)
+        self.prefetch_timer = QTimer()
+        self.prefetch_timer.setSingleShot(True)
+        self.prefetch_timer.setInterval(self.prefetch_delay)
+        self.prefetch_timer.timeout.connect(self.prefetch)
+        self.metrics = Metrics(database.metrics_log)
+
         # table dock
         result_dock = QDockWidget('Results')
-        self.result_table = QTableWidget(1, 1)
+        self.result_model = ResultModel()
+        self.result_table = QTableView()
+        self.result_table.setModel(self.result_model)
         self.result_table.setMinimumHeight(100)
-        result_dock.setWidget(self.result_table)
+        # columns are sorted, moved and hidden without querying again
+        header = self.result_table.horizontalHeader()
+        header.setMovable(True)
+        header.setContextMenuPolicy(Qt.CustomContextMenu)
+        header.customContextMenuRequested.connect(self.column_menu)
+        header.setSortIndicator(-1, Qt.AscendingOrder)
+        self.result_table.setSortingEnabled(True)
+        self.result_filter = QLineEdit()
+        self.result_filter.setPlaceholderText('Filter rows')
+        self.result_filter.textChanged.connect(self.result_model.set_filter)
+        result_widget = QWidget()
+        result_layout = QVBoxLayout()
+        result_layout.setContentsMargins(0, 0, 0, 0)
+        result_layout.addWidget(self.result_filter)
+        result_layout.addWidget(self.result_table)
+        result_widget.setLayout(result_layout)
+        result_dock.setWidget(result_widget)
 
         # query dock
         query_dock = QDockWidget('Query')
@@ -38,78 +93,542 @@ class MainWindow(QMainWindow):
         self.query_view.setReadOnly(True)
         query_dock.setWidget(self.query_view)
 
+        # plan dock
+        plan_dock = QDockWidget('Plan')
+        self.plan_view = QPlainTextEdit()
+        self.plan_view.setReadOnly(True)
+        self.plan_view.setLineWrapMode(QPlainTextEdit.NoWrap)
+        plan_dock.setWidget(self.plan_view)
+
+        # statistics dock
+        stats_dock = QDockWidget('Statistics')
+        self.stats_view = QPlainTextEdit()
+        self.stats_view.setReadOnly(True)
+        self.stats_view.setLineWrapMode(QPlainTextEdit.NoWrap)
+        stats_dock.setWidget(self.stats_view)
+        self.stats_thread = None
+        self.stats_threads = set()
+        self.stats_key = None
+        self.stats_count = self.stats_text = ''
+
+        # timings dock
+        timing_dock = QDockWidget('Timings')
+        self.timing_view = QPlainTextEdit()
+        self.timing_view.setReadOnly(True)
+        self.timing_view.setMaximumBlockCount(self.metrics.history)
+        timing_dock.setWidget(self.timing_view)
+
         # constraint dock
         constraint_dock = QDockWidget('Constraints')
         self.constraints = QPlainTextEdit()
         constraint_dock.setWidget(self.constraints)
         self.constraints.textChanged.connect(self.set_constraints)
+        self.constraint_timer = QTimer()
+        self.constraint_timer.setSingleShot(True)
+        self.constraint_timer.setInterval(self.constraint_delay)
+        self.constraint_timer.timeout.connect(self.apply_constraints)
+        # the check of the constraints last applied, and every one running
+        self.constraint_check = None
+        self.constraint_checks = set()
 
         # joins dock
         join_dock = QDockWidget('Joins')
-        items = meta.tables.keys()
-        self.joins = JoinList(items, meta)
+        self.joins = JoinList(schema.names, schema)
         join_dock.setWidget(self.joins)
 
         # menu
         filemenu = self.menuBar().addMenu('&File')
         newquery = QAction('&New Query', filemenu)
+        open_scene = QAction('&Open Scene...', filemenu)
+        save_scene = QAction('&Save Scene...', filemenu)
         quit_ = QAction('&Quit', filemenu)
         filemenu.addAction(newquery)
+        filemenu.addAction(open_scene)
+        filemenu.addAction(save_scene)
+        self.database_menu = filemenu.addMenu('&Open Database')
+        self.database_menu.aboutToShow.connect(self.list_databases)
         filemenu.addAction(quit_)
         newquery.triggered.connect(self.scene.reset_scene)
         newquery.triggered.connect(self.joins.reset)
-        quit_.triggered.connect(sys.exit)
+        newquery.triggered.connect(self.runner.cancel)
+        newquery.triggered.connect(self.result_model.clear)
+        newquery.triggered.connect(self.cancel_stats)
+        newquery.triggered.connect(self.stop_prefetch)
+        open_scene.triggered.connect(self.open_scene)
+        save_scene.triggered.connect(self.save_scene)
+        quit_.triggered.connect(QApplication.quit)
+
+        resultmenu = self.menuBar().addMenu('&Results')
+        previous_page = QAction('&Previous Page', resultmenu)
+        next_page = QAction('&Next Page', resultmenu)
+        page_size = QAction('Page &Size...', resultmenu)
+        refresh = QAction('&Refresh', resultmenu)
+        export = QAction('&Export...', resultmenu)
+        self.stats_action = QAction('Column &Statistics', resultmenu)
+        self.stats_action.setCheckable(True)
+        self.stats_action.setChecked(True)
+        self.prefetch_action = QAction('Prefetch &Neighbours', resultmenu)
+        self.prefetch_action.setCheckable(True)
+        self.prefetch_action.setChecked(database.prefetch)
+        refresh.setShortcut(QKeySequence.Refresh)
+        previous_page.setShortcut(QKeySequence('Ctrl+PgUp'))
+        next_page.setShortcut(QKeySequence('Ctrl+PgDown'))
+        resultmenu.addAction(previous_page)
+        resultmenu.addAction(next_page)
+        resultmenu.addAction(page_size)
+        resultmenu.addSeparator()
+        resultmenu.addAction(refresh)
+        resultmenu.addAction(export)
+        resultmenu.addSeparator()
+        resultmenu.addAction(self.stats_action)
+        resultmenu.addAction(self.prefetch_action)
+        previous_page.triggered.connect(self.scene.previous_page)
+        next_page.triggered.connect(self.next_page)
+        page_size.triggered.connect(self.set_page_size)
+        refresh.triggered.connect(self.refresh)
+        export.triggered.connect(self.export)
+        self.stats_action.toggled.connect(self.toggle_stats)
+        self.prefetch_action.toggled.connect(self.stop_prefetch)
+        self.export_thread = None
 
         # layout
         self.addDockWidget(Qt.BottomDockWidgetArea, result_dock)
         self.addDockWidget(Qt.BottomDockWidgetArea, query_dock)
         self.addDockWidget(Qt.BottomDockWidgetArea, constraint_dock)
+        self.addDockWidget(Qt.BottomDockWidgetArea, timing_dock)
         self.tabifyDockWidget(result_dock, query_dock)
         self.tabifyDockWidget(query_dock, constraint_dock)
+        self.tabifyDockWidget(constraint_dock, timing_dock)
+        self.tabifyDockWidget(timing_dock, stats_dock)
+        if self.runner.guard is not None:
+            self.addDockWidget(Qt.BottomDockWidgetArea, plan_dock)
+            self.tabifyDockWidget(query_dock, plan_dock)
         result_dock.raise_()
         self.addDockWidget(Qt.LeftDockWidgetArea, join_dock)
         self.setCentralWidget(graph)
 
+    def list_databases(self):
+        """Fill the open database menu with the configured databases."""
+        menu = self.database_menu
+        menu.clear()
+        for name in databases:
+            action = menu.addAction(name)
+            action.triggered.connect(lambda checked=False, name=name:
+                                     open_window(databases[name]))
+        menu.addSeparator()
+        other = menu.addAction('&Other...')
+        other.triggered.connect(self.open_url)
+
+    def open_url(self):
+        """Ask for a database URL and open it in a new window."""
+        url, ok = QInputDialog.getText(self, 'Open Database',
+                                       'SQLAlchemy URL:')
+        url = str(url).strip()
+        if ok and url:
+            database = databases.get(url)
+            if database is None:
+                database = databases[url] = Database(url, url)
+            open_window(database)
+
+    def open_scene(self):
+        """Replace the scene with a saved one.
+
+        The query isn't run until the selection changes or the results are
+        refreshed, so nothing is asked of the database while loading.
+
+        """
+        path = str(QFileDialog.getOpenFileName(self, 'Open Scene', '',
+                                               'Scenes (*.json)'))
+        if not path:
+            return
+        try:
+            definition = read_scene(path)
+        except (IOError, OSError, ValueError) as e:
+            self.statusBar().showMessage('Opening failed: {0}'.format(e))
+            return
+        self.runner.cancel()
+        self.constraint_timer.stop()
+        self.constraint_check = None
+        self.cancel_stats()
+        self.stop_prefetch()
+        self.result_model.clear()
+        self.joins.reset()
+        self.scene.load(definition)
+        self.constraints.blockSignals(True)
+        self.constraints.setPlainText(self.scene.constraints)
+        self.constraints.blockSignals(False)
+        self.query_view.clear()
+        self.statusBar().showMessage('Opened scene {0}'.format(path))
+
+    def save_scene(self):
+        """Save the tables, joins and constraints of the scene to a file.
+
+        Saved scenes can be run without the gui by batch.py.
+
+        """
+        if not len(self.scene.graph):
+            self.statusBar().showMessage('Nothing to save')
+            return
+        path = str(QFileDialog.getSaveFileName(self, 'Save Scene', '',
+                                               'Scenes (*.json)'))
+        if not path:
+            return
+        try:
+            write_scene(path, self.scene.definition())
+        except (IOError, OSError) as e:
+            self.statusBar().showMessage('Saving failed: {0}'.format(e))
+            return
+        self.statusBar().showMessage('Saved scene to {0}'.format(path))
+
     def table_change(self, name):
         """When the table changes, set the filters."""
         self.joins.set_table(name)
 
     def query_change(self):
-        """When the query changes, run the query and show results.
+        """When the query changes, start running it in the background.
 
-        This will clear the table and then add the results.  It also adds the
-        query string to the query view.
+        The query string is added to the query view right away, the results are
+        shown once the runner reports them.  Changing the query again before
+        then cancels the query in flight.
 
         """
-        query = self.scene.query
+        self.stop_prefetch()
+        self.query_view.setPlainText(self.scene.sql)
+        self.plan_view.clear()
+        self.statusBar().showMessage('Running query...')
+        self.runner.run(self.scene.compiled, timing=self.scene.timing)
 
-        self.query_view.setPlainText(str(query))
+    def plan_text(self, plan):
+        """Describe a plan along with what is wrong with the joins."""
+        lines = ['Warning: {0}'.format(x) for x in self.scene.join_warnings()]
+        if plan is not None:
+            lines.append(plan.summary())
+        return '\n'.join(lines)
 
-        results = engine.execute(query)
-        keys = results.keys()
-        self.result_table.clear()
-        self.result_table.setColumnCount(len(keys))
-        self.result_table.setRowCount(0)
+    def show_plan(self, plan):
+        self.plan_view.setPlainText(self.plan_text(plan))
 
-        cols_set = False
-        row = -1
-        for row, result in enumerate(results):
-            self.result_table.setRowCount(row + 1)
-            for column, data in enumerate(result):
-                self.result_table.setItem(row, column,
-                                          QTableWidgetItem(str(data)))
+    def query_held(self, plan):
+        """Ask before running a query the guard thinks is too costly.
 
-        if not cols_set:
-            self.result_table.setHorizontalHeaderLabels(list(keys))
+        If costly queries are blocked it is only reported.
+
+        """
+        message = 'Expected to examine {0:,} rows'.format(plan.estimate)
+        if self.runner.guard.block:
+            self.statusBar().showMessage('Query blocked: {0}'.format(message))
+            return
+        self.statusBar().showMessage('Query held: {0}'.format(message))
+        answer = QMessageBox.question(
+            self, 'Run Query?', '{0}.  Run it anyway?\n\n{1}'.format(
+                message, self.plan_text(plan)),
+            QMessageBox.Yes | QMessageBox.No, QMessageBox.No)
+        if answer == QMessageBox.Yes:
+            self.statusBar().showMessage('Running query...')
+            self.runner.confirm()
+
+    def show_results(self, keys, rows, cursor):
+        """Replace the results in the table.
+
+        Only the first batch of rows has been fetched, the model pulls the rest
+        from the cursor as the table is scrolled.
+
+        Filling the table is the last phase of the query timing, the timing is
+        then shown and added to the history.
+
+        """
+        timing = self.runner.timing
+        with timing.phase('populate'):
+            self.result_model.set_results(keys, rows, cursor)
+        timing.rows = len(rows)
+        timing.bytes = result_size(keys, rows)
+        self.metrics.record(timing)
+        self.timing_view.appendPlainText(timing.summary())
+        self.timing_view.setToolTip(self.metrics.summary())
+
+        self.start_stats()
+        if self.prefetch_action.isChecked():
+            self.prefetch_timer.start()
+
+        message = 'Page {0}'.format(self.scene.pager.page + 1)
+        if self.runner.from_cache:
+            message += ' (cached)'
+        self.statusBar().showMessage('{0} - {1}'.format(message,
+                                                        timing.summary()))
+
+    def refresh(self):
+        """Run the current query again, skipping the result cache.
+
+        A scene that was just opened has no query yet, it is run now.
+
+        """
+        if getattr(self.scene, 'compiled', None) is None:
+            if self.scene.selectedItems():
+                self.scene.run_query()
+            return
+        self.statusBar().showMessage('Running query...')
+        self.runner.run(self.scene.compiled, refresh=True)
+
+    def next_page(self):
+        """Move to the next page if the current one is full."""
+        if self.runner.is_running():
+            return
+        self.result_model.fetch_all()
+        if self.result_model.fetched() < self.scene.pager.page_size:
+            self.statusBar().showMessage('No more results', 2000)
+            return
+        self.scene.next_page(self.result_model.last_row())
+
+    def column_menu(self, pos):
+        """Show or hide the columns of the results."""
+        header = self.result_table.horizontalHeader()
+        menu = QMenu(self)
+        for column, key in enumerate(self.result_model.keys):
+            action = menu.addAction(key)
+            action.setCheckable(True)
+            action.setChecked(not header.isSectionHidden(column))
+            action.setData(column)
+        action = menu.exec_(header.mapToGlobal(pos))
+        if action is None:
+            return
+        column = action.data().toInt()[0]
+        header.setSectionHidden(column, not action.isChecked())
+
+    def set_page_size(self):
+        """Ask for a new page size and rerun the query."""
+        pager = self.scene.pager
+        size, ok = QInputDialog.getInt(self, 'Page Size', 'Rows per page:',
+                                       pager.page_size, 1, 1000000)
+        if ok:
+            pager.set_page_size(size)
+            if hasattr(self.scene, 'query'):
+                self.scene.run_query()
+
+    def export(self):
+        """Write every row of the current query to a file.
+
+        The rows are streamed in the background.  A progress dialog counts
+        them and cancels the export if asked.
+
+        """
+        if self.export_thread is not None:
+            self.statusBar().showMessage('An export is already running')
+            return
+        if not self.scene.selectedItems():
+            self.statusBar().showMessage('Nothing to export')
+            return
+        filters = ';;'.join('{0} (*.{1})'.format(name.upper(), name)
+                            for name in formats)
+        path = str(QFileDialog.getSaveFileName(self, 'Export Results', '',
+                                               filters))
+        if not path:
+            return
+
+        thread = ExportThread(self.schema.engine, self.scene.export_query(),
+                              path)
+        progress = QProgressDialog('Exporting...', 'Cancel', 0, 0, self)
+        progress.setWindowTitle('Export Results')
+        progress.canceled.connect(thread.cancel)
+        thread.progress.connect(lambda rows: progress.setLabelText(
+            'Exported {0} rows...'.format(rows)))
+        thread.finished.connect(lambda: self.export_finished(thread, progress))
+        self.export_thread = thread
+        thread.start()
+        progress.show()
+
+    def export_finished(self, thread, progress):
+        """Report how the export went."""
+        self.export_thread = None
+        progress.reset()
+        progress.deleteLater()
+        if thread.error is not None:
+            message = 'Export failed: {0}'.format(thread.error)
+        elif thread.cancelled:
+            message = 'Export cancelled'
+        else:
+            message = 'Exported {0} rows to {1}'.format(thread.rows,
+                                                        thread.path)
+        self.statusBar().showMessage(message)
+
+    def start_stats(self):
+        """Count and describe the rows of the scene in the background.
+
+        This only starts over when the rows change, not for every page.
+
+        """
+        key = self.scene.rows_key()
+        if not self.stats_action.isChecked() or key == self.stats_key:
+            return
+        self.cancel_stats()
+        self.stats_key = key
+        thread = StatsThread(self.schema.engine, self.scene.export_query())
+        thread.count_ready.connect(
+            lambda rows, exact: self.show_count(thread, rows, exact))
+        thread.count_over.connect(
+            lambda rows: self.show_count_over(thread, rows))
+        thread.stats_ready.connect(
+            lambda text, done: self.show_stats(thread, text, done))
+        thread.finished.connect(lambda: self.stats_finished(thread))
+        self.stats_thread = thread
+        self.stats_threads.add(thread)
+        self.stats_count = 'Rows: counting...'
+        self.stats_text = ''
+        self.update_stats_view()
+        thread.start(QThread.LowPriority)
+
+    def cancel_stats(self):
+        """Stop counting the rows of the last query."""
+        if self.stats_thread is not None:
+            self.stats_thread.cancel()
+            self.stats_thread = None
+        self.stats_key = None
+        self.stats_view.clear()
+
+    def toggle_stats(self, checked):
+        if checked:
+            if self.scene.selectedItems() and self.result_model.keys:
+                self.start_stats()
+        else:
+            self.cancel_stats()
+
+    def show_count(self, thread, rows, exact):
+        if thread is not self.stats_thread:
+            return
+        if exact:
+            self.stats_count = 'Rows: {0:,}'.format(rows)
+        else:
+            self.stats_count = 'Rows: about {0:,} (estimated)'.format(rows)
+        self.update_stats_view()
+
+    def show_count_over(self, thread, rows):
+        if thread is not self.stats_thread:
+            return
+        self.stats_count = 'Rows: more than {0:,}'.format(rows)
+        self.update_stats_view()
+
+    def show_stats(self, thread, text, done):
+        if thread is not self.stats_thread:
+            return
+        if done:
+            self.stats_text = text
+        else:
+            self.stats_text = text + '\n\nReading rows...'
+        self.update_stats_view()
+
+    def stats_finished(self, thread):
+        self.stats_threads.discard(thread)
+        if thread is not self.stats_thread:
+            return
+        self.stats_thread = None
+        if thread.error is not None:
+            self.stats_text = 'Statistics failed: {0}'.format(thread.error)
+            self.update_stats_view()
+
+    def update_stats_view(self):
+        self.stats_view.setPlainText('{0}\n\n{1}'.format(self.stats_count,
+                                                         self.stats_text))
+
+    def prefetch(self):
+        """Prefetch the results of joining the tables next to the selection.
+
+        The tables are taken from the top of the join list, which lists the
+        neighbours of the selected table.  Only pages small enough to be
+        fetched in one batch are prefetched.
+
+        """
+        items = self.scene.selectedItems()
+        if self.runner.is_running() or len(items) != 1:
+            return
+        if self.scene.pager.page_size >= QueryThread.batch_size:
+            return
+        neighbours = self.schema.graph.neighbours(items[0].name)
+        names = [x for x in self.joins.model.visible if x in neighbours]
+        try:
+            queries = self.scene.neighbour_queries(
+                names[:self.prefetch_tables])
+        except Exception:
+            return
+        self.prefetcher.start(queries)
+
+    def stop_prefetch(self):
+        """Stop prefetching, the user is doing something else."""
+        self.prefetch_timer.stop()
+        self.prefetcher.cancel()
+
+    def show_error(self, message):
+        """Show a failed query in the status bar."""
+        self.statusBar().showMessage('Query failed: {0}'.format(message))
 
     def set_constraints(self):
-        """Update the query constraints when the constraint text changes."""
-        self.scene.constraints = self.constraints.toPlainText() or ''
+        """Wait for typing to pause before using the new constraints.
+
+        The query running for earlier constraints is of no use anymore, so it
+        is cancelled right away.
+
+        """
+        self.runner.cancel()
+        self.stop_prefetch()
+        self.constraint_check = None
+        self.constraint_timer.start()
+
+    def apply_constraints(self):
+        """Update the query constraints and rerun the query.
+
+        Constraints that are obviously incomplete are reported in the status
+        bar instead of being run.  The rest are checked by the database in
+        the background first, and only used if it takes them.
+
+        """
+        text = str(self.constraints.toPlainText() or '')
+        error = constraint_error(text)
+        if error:
+            self.statusBar().showMessage('Constraints: {0}'.format(error))
+            return
+        if not text.strip() or not self.scene.selectedItems():
+            self.scene.set_constraints(text)
+            return
+        thread = ConstraintThread(self.schema.engine,
+                                  self.scene.constraint_query(text), text)
+        thread.finished.connect(lambda: self.constraints_checked(thread))
+        self.constraint_check = thread
+        self.constraint_checks.add(thread)
+        thread.start()
+
+    def constraints_checked(self, thread):
+        """Use the constraints the database took, report the error if not."""
+        self.constraint_checks.discard(thread)
+        if thread is not self.constraint_check:
+            return
+        self.constraint_check = None
+        if thread.error:
+            self.statusBar().showMessage(
+                'Constraints: {0}'.format(thread.error))
+            return
+        self.scene.set_constraints(thread.text)
+
+
+def open_window(database):
+    """Show the window for a database, creating it if needed.
+
+    Each window has its own engine, pool and schema.
+
+    """
+    window = windows.get(database.name)
+    if window is None:
+        window = MainWindow(database)
+        QApplication.instance().aboutToQuit.connect(database.schema.save)
+        QApplication.instance().aboutToQuit.connect(database.dispose)
+        windows[database.name] = window
+    window.show()
+    window.raise_()
+    return window
 
 
 # Run the application
 if __name__ == "__main__":
     app = QApplication(sys.argv)
-    window = MainWindow()
-    window.show()
+    configured, selected = parse_args(sys.argv[1:])
+    databases.update(configured)
+    for database in selected:
+        open_window(database)
     sys.exit(app.exec_())
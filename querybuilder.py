@@ -0,0 +1,170 @@
+from sqlalchemy import select
+
+from paging import unique_columns
+
+
+class QueryTable(object):
+    """A table of a query, under its alias.
+
+    This is what the scene's table items are to the query, without the
+    graphics.
+
+    """
+
+    def __init__(self, table, alias, columns=None):
+        """Alias a schema table, columns limits the columns selected."""
+        self.name = table.name
+        self.alias = alias
+        self.table = table.alias(alias)
+        self.columns = columns
+
+
+class QueryRelation(object):
+    """A join from a parent table to a child table."""
+
+    def __init__(self, from_table, to_table, condition, outer=False):
+        self.from_table = from_table
+        self.to_table = to_table
+        self.condition = condition
+        self.outer = outer
+
+    def is_outer(self):
+        return self.outer
+
+
+def get_columns(tables):
+    """Get the columns of the selected tables.
+
+    Tables select every column unless they list the ones they want.
+
+    """
+    columns = []
+    for table in tables:
+        names = getattr(table, 'columns', None)
+        if names is None:
+            columns.extend(table.table.c)
+        else:
+            columns.extend(table.table.c[x] for x in names)
+    return columns
+
+
+def get_where(constraints):
+    """Get the constraints, kept apart from anything added to them."""
+    if constraints.strip():
+        constraints = '({0})'.format(constraints)
+    return constraints
+
+
+def join(graph, query, table, outer=False):
+    """Recursively join the tables below a table."""
+    for relation in graph.child_relations(table):
+        child = relation.to_table
+
+        if relation.condition is None:
+            continue
+
+        if relation.is_outer() or outer:
+            query = query.outerjoin(child.table, relation.condition)
+        else:
+            query = query.join(child.table, relation.condition)
+
+        query = join(graph, query, child, relation.is_outer())
+    return query
+
+
+def missing_joins(graph):
+    """Get the relations without a join condition.
+
+    These are left out of the joins, so any selected table below one ends
+    up in the query as a cross join.
+
+    """
+    return [x for x in graph.relations if x.condition is None]
+
+
+def get_key_columns(graph, root):
+    """Get the columns that uniquely identify each row of the query.
+
+    This is the primary key of the root table, as long as every join
+    matches at most one row.  Otherwise None is returned.
+
+    """
+    columns = list(root.table.primary_key)
+    if not columns:
+        return None
+    for relation in graph.descendants(root):
+        if relation.condition is None:
+            # a cross join repeats the key
+            return None
+        if not unique_columns(relation.condition, relation.to_table.table):
+            return None
+    return columns
+
+
+def joined_tables(graph, table):
+    """Get a table and the tables joined below it."""
+    tables = [table]
+    for relation in graph.child_relations(table):
+        if relation.condition is not None:
+            tables.extend(joined_tables(graph, relation.to_table))
+    return tables
+
+
+def get_order_columns(graph, root, selected):
+    """Get columns that sort the rows of the query the same way every time.
+
+    These are the primary keys of every table in the query, the tables
+    joined from the root and the selected tables, which are cross joined
+    if they aren't joined.  When a table has no primary key the selected
+    columns are sorted on as well.
+
+    """
+    tables = []
+    for table in joined_tables(graph, root) + list(selected):
+        if table not in tables:
+            tables.append(table)
+    columns = []
+    for table in tables:
+        primary = list(table.table.primary_key)
+        if not primary:
+            seen = set(id(x) for x in columns)
+            return columns + [x for x in get_columns(selected)
+                              if id(x) not in seen]
+        columns.extend(primary)
+    return columns
+
+
+def build_query(graph, selected, constraints='', pager=None):
+    """Create the query for the tables of a graph.
+
+    The columns of the selected tables are queried, joined from the root
+    of the graph.  With a pager the query is restricted to the current
+    page.  If keyset pagination is used the key columns are added to the
+    query when they are not selected.
+
+    Returns the query and the positions of the key columns in it, None
+    without keyset pagination.
+
+    """
+    root = graph.root()
+    cols = get_columns(selected)
+    query_from = join(graph, root.table, root)
+    if pager is None:
+        return select(cols, get_where(constraints), from_obj=query_from), None
+
+    key_columns = get_key_columns(graph, root)
+    key_indexes = None
+    if key_columns:
+        key_indexes = []
+        for column in key_columns:
+            index = [i for i, x in enumerate(cols) if x is column]
+            if not index:
+                index = [len(cols)]
+                cols.append(column)
+            key_indexes.append(index[0])
+
+    query = select(cols, get_where(constraints), from_obj=query_from)
+    if key_columns:
+        return pager.apply(query, key_columns), key_indexes
+    order_columns = get_order_columns(graph, root, selected)
+    return pager.apply(query, None, order_columns), key_indexes
@@ -0,0 +1,44 @@
+from collections import OrderedDict
+
+
+class QueryCache(object):
+    """Built queries of a scene, keyed on what they were built from.
+
+    The key is split in two.  The structure is the tables and relations of
+    the scene, anything else (selection, constraints, page) is the rest of
+    the key.  Entries are only kept for the current structure, changing it
+    drops the entries built from the old one.
+
+    """
+
+    size = 64
+
+    def __init__(self, size=None):
+        """Initialize an empty cache."""
+        if size is not None:
+            self.size = size
+        self.structure = None
+        self.entries = OrderedDict()
+
+    def clear(self):
+        self.structure = None
+        self.entries.clear()
+
+    def get(self, structure, key):
+        """Get a cached entry, None if there isn't one."""
+        if structure != self.structure:
+            self.entries.clear()
+            self.structure = structure
+            return None
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.entries[key] = entry
+        return entry
+
+    def put(self, structure, key, entry):
+        if structure != self.structure:
+            self.entries.clear()
+            self.structure = structure
+        self.entries[key] = entry
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
@@ -0,0 +1,182 @@
+import numpy as np
+from PyQt4.QtCore import Qt, QAbstractTableModel, QModelIndex, QVariant
+
+from resultstore import ResultStore
+
+
+class ResultModel(QAbstractTableModel):
+    """Table model for query results.
+
+    Rows are kept by column in a result store and only turned into strings
+    when the view asks for a visible cell.  If the query has more rows than
+    were fetched up front the rest are pulled from the open cursor a batch
+    at a time as the view scrolls.
+
+    Sorting and filtering happen on the rows in memory, the model then
+    shows the rows of the store through a list of row numbers.  Sorting
+    fetches the rest of the rows first, so every row is in order.
+
+    """
+
+    batch_size = 256
+
+    def __init__(self, parent=None):
+        """Initialize an empty model."""
+        QAbstractTableModel.__init__(self, parent)
+        self.store = ResultStore([])
+        self.cursor = None
+        # the rows of the store shown, None for all of them in order
+        self.view = None
+        self.sort_column = -1
+        self.sort_order = Qt.AscendingOrder
+        self.filter_text = ''
+
+    @property
+    def keys(self):
+        return self.store.keys
+
+    def set_results(self, keys, rows, cursor=None):
+        """Replace the results, closing any cursor still open.
+
+        The rows are sorted and filtered the same way as the last ones.
+
+        """
+        self.beginResetModel()
+        self.close()
+        self.store = ResultStore(keys, [tuple(x) for x in rows])
+        self.cursor = cursor
+        if self.sort_column >= len(self.store.keys):
+            self.sort_column = -1
+        if self.sort_column >= 0:
+            self.fetch_rest()
+        self.update_view()
+        self.endResetModel()
+
+    def clear(self):
+        self.set_results([], [])
+
+    def close(self):
+        """Close the open cursor, no more rows will be fetched."""
+        if self.cursor is not None:
+            self.cursor.close()
+            self.cursor = None
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        if self.view is None:
+            return len(self.store)
+        return len(self.view)
+
+    def columnCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.store.keys)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid() or role != Qt.DisplayRole:
+            return QVariant()
+        row = index.row()
+        if self.view is not None:
+            row = self.view[row]
+        return QVariant(str(self.store.value(row, index.column())))
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role != Qt.DisplayRole:
+            return QVariant()
+        if orientation == Qt.Horizontal:
+            return QVariant(self.store.keys[section])
+        return QVariant(section + 1)
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and self.cursor is not None
+
+    def fetch_rows(self):
+        """Fetch the next batch of rows from the cursor into the store."""
+        try:
+            rows = self.cursor.fetchmany(self.batch_size)
+        except Exception:
+            rows = []
+        if len(rows) < self.batch_size:
+            self.close()
+        self.store.extend([tuple(x) for x in rows])
+        return len(rows)
+
+    def fetchMore(self, parent=QModelIndex()):
+        """Fetch the next batch of rows, showing those that pass the filter."""
+        if parent.isValid() or self.cursor is None:
+            return
+        start = len(self.store)
+        if not self.fetch_rows():
+            return
+
+        if self.view is None:
+            rows = np.arange(start, len(self.store))
+        else:
+            rows = start + np.flatnonzero(
+                self.store.matches(self.filter_text, start=start))
+            if not len(rows):
+                return
+        first = self.rowCount()
+        self.beginInsertRows(QModelIndex(), first, first + len(rows) - 1)
+        if self.view is not None:
+            self.view = np.concatenate([self.view, rows])
+        self.endInsertRows()
+
+    def fetch_rest(self):
+        """Fetch every row left on the cursor, without updating the view."""
+        while self.cursor is not None:
+            self.fetch_rows()
+
+    def fetch_all(self):
+        """Fetch every row left on the cursor."""
+        if self.cursor is None:
+            return
+        self.beginResetModel()
+        self.fetch_rest()
+        self.update_view()
+        self.endResetModel()
+
+    def fetched(self):
+        """Get the number of rows fetched so far."""
+        return len(self.store)
+
+    def last_row(self):
+        """Get the last row fetched, in the order of the query."""
+        return self.store.row(len(self.store) - 1)
+
+    def update_view(self):
+        """Work out which rows are shown, and in what order."""
+        view = None
+        if self.sort_column >= 0 and len(self.store):
+            view = self.store.argsort(self.sort_column,
+                                      self.sort_order == Qt.DescendingOrder)
+        if self.filter_text:
+            found = self.store.matches(self.filter_text)
+            if view is None:
+                view = np.flatnonzero(found)
+            else:
+                view = view[found[view]]
+        self.view = view
+
+    def sort(self, column, order=Qt.AscendingOrder):
+        """Sort the rows by a column, -1 for the order of the query."""
+        if (column, order) == (self.sort_column, self.sort_order):
+            return
+        # fetching the rest of the rows changes the row count, so this is a
+        # reset rather than a layout change
+        self.beginResetModel()
+        self.sort_column = column
+        self.sort_order = order
+        if column >= 0:
+            self.fetch_rest()
+        self.update_view()
+        self.endResetModel()
+
+    def set_filter(self, text):
+        """Show just the rows with the text in a column, ignoring case."""
+        self.beginResetModel()
+        # unicode, a QString can hold text str can't
+        self.filter_text = unicode(text)
+        self.update_view()
+        self.endResetModel()
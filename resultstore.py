@@ -0,0 +1,309 @@
+import re
+import sys
+
+import numpy as np
+
+
+def grow(array, size):
+    """Get an array with room for size items, doubling it if it is full."""
+    if size <= len(array):
+        return array
+    bigger = np.zeros(max(size, 2 * len(array), 16), dtype=array.dtype)
+    bigger[:len(array)] = array
+    return bigger
+
+
+def sort_key(value):
+    # None sorts first, as it does when comparing in python
+    return value is not None, value
+
+
+def as_text(value):
+    """Get a value as unicode, strings whatever they were encoded with."""
+    if isinstance(value, unicode):
+        return value
+    if not isinstance(value, str):
+        value = str(value)
+    try:
+        return value.decode('utf-8')
+    except UnicodeDecodeError:
+        return value.decode('latin-1')
+
+
+def encoding_key(value):
+    """Get the key a value is encoded under.
+
+    Values that are equal but show differently, like 1 and Decimal('1.0'),
+    need codes of their own.
+
+    """
+    if type(value) in (str, unicode):
+        return value
+    return type(value), str(value)
+
+
+class TextIndex(object):
+    """Strings joined into one, to search them all with a single scan.
+
+    The strings are kept in order and have to be lower case unicode,
+    without line breaks.  A search gets a mask of the ones containing the text.
+
+    """
+
+    def __init__(self):
+        self.pieces = []
+        self.text = u''
+        self.starts = np.zeros(0, dtype=np.int64)
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def extend(self, strings):
+        lengths = np.fromiter(map(len, strings), dtype=np.int64,
+                              count=len(strings)) + 1
+        offset = len(self.text)
+        starts = offset + np.cumsum(lengths) - lengths
+        self.starts = np.concatenate([self.starts, starts])
+        self.text += '\n'.join(strings) + '\n'
+        self.size += len(strings)
+
+    def search(self, text, start=0):
+        """Get a mask of the strings from start that contain the text."""
+        found = np.zeros(self.size - start, dtype=bool)
+        if not text or '\n' in text:
+            return found
+        offset = self.starts[start] if start < self.size else len(self.text)
+        pattern = re.compile(re.escape(text.lower()))
+        positions = np.fromiter(
+            (x.start() for x in pattern.finditer(self.text, offset)),
+            dtype=np.int64)
+        if len(positions):
+            found[np.searchsorted(self.starts, positions, 'right') - 1 -
+                  start] = True
+        return found
+
+
+class NumberColumn(object):
+    """A column of integers or floats, kept in an array.
+
+    Nulls are kept in a mask next to the values.
+
+    """
+
+    types = {int: np.int64, long: np.int64, float: np.float64}
+
+    def __init__(self, dtype):
+        self.dtype = dtype
+        self.values = np.zeros(0, dtype=dtype)
+        self.nulls = np.zeros(0, dtype=bool)
+        self.size = 0
+        # the values as strings, made when searching
+        self.index = TextIndex()
+
+    @classmethod
+    def dtypes(cls, values):
+        """Get the array types of the values, None for anything else."""
+        return set(cls.types.get(type(x)) for x in values if x is not None)
+
+    def extend(self, values):
+        """Add the values, returning False if they don't fit the column."""
+        if not self.dtypes(values) <= set([self.dtype]):
+            return False
+        nulls = np.fromiter((x is None for x in values), dtype=bool,
+                            count=len(values))
+        try:
+            array = np.array([0 if x is None else x for x in values],
+                             dtype=self.dtype)
+        except OverflowError:
+            return False
+        size = self.size + len(values)
+        self.values = grow(self.values, size)
+        self.nulls = grow(self.nulls, size)
+        self.values[self.size:size] = array
+        self.nulls[self.size:size] = nulls
+        self.size = size
+        return True
+
+    def value(self, row):
+        if self.nulls[row]:
+            return None
+        return self.values.item(row)
+
+    def all_values(self):
+        return [self.value(x) for x in xrange(self.size)]
+
+    def argsort(self):
+        """Get the rows in the order of their values, nulls first."""
+        return np.lexsort((self.values[:self.size], ~self.nulls[:self.size]))
+
+    def matches(self, text, start=0):
+        """Find the rows whose value as a string contains the text."""
+        # most text can't appear in a number at all
+        if text.strip('0123456789-.e+nafio'):
+            return np.zeros(self.size - start, dtype=bool)
+        index = self.index
+        if len(index) < self.size:
+            strings = map(str, self.values[len(index):self.size].tolist())
+            for i in np.flatnonzero(self.nulls[len(index):self.size]):
+                strings[i] = 'none'
+            index.extend(strings)
+        return index.search(text, start)
+
+    def nbytes(self):
+        return self.values[:self.size].nbytes + self.nulls[:self.size].nbytes
+
+
+class EncodedColumn(object):
+    """A column of any other values, dictionary encoded.
+
+    Each distinct value is kept once and rows refer to it by its code.
+    Sorting and searching work on the distinct values and then map the
+    result to every row through the codes.
+
+    """
+
+    def __init__(self):
+        self.values = []
+        self.codes = {}
+        self.rows = np.zeros(0, dtype=np.int32)
+        self.size = 0
+        # the distinct values as strings, made when searching
+        self.index = TextIndex()
+
+    def extend(self, values):
+        codes = self.codes
+        distinct = self.values
+        encoded = np.empty(len(values), dtype=np.int32)
+        for i, value in enumerate(values):
+            key = encoding_key(value)
+            code = codes.get(key)
+            if code is None:
+                code = codes[key] = len(distinct)
+                distinct.append(value)
+            encoded[i] = code
+        size = self.size + len(values)
+        self.rows = grow(self.rows, size)
+        self.rows[self.size:size] = encoded
+        self.size = size
+        return True
+
+    def value(self, row):
+        return self.values[self.rows[row]]
+
+    def all_values(self):
+        values = self.values
+        return [values[x] for x in self.rows[:self.size].tolist()]
+
+    def argsort(self):
+        """Get the rows in the order of their values.
+
+        The distinct values are sorted and ranked, the rows are then sorted
+        by the rank of their value.
+
+        """
+        try:
+            order = sorted(xrange(len(self.values)),
+                           key=lambda x: sort_key(self.values[x]))
+        except TypeError:
+            # values that don't compare, like dates and strings
+            order = sorted(xrange(len(self.values)),
+                           key=lambda x: as_text(self.values[x]))
+        ranks = np.empty(len(self.values), dtype=np.int32)
+        ranks[order] = np.arange(len(order), dtype=np.int32)
+        return np.argsort(ranks[self.rows[:self.size]], kind='mergesort')
+
+    def matches(self, text, start=0):
+        """Find the rows whose value as a string contains the text."""
+        index = self.index
+        if len(index) < len(self.values):
+            index.extend([as_text(x).lower().replace(u'\n', u' ')
+                          for x in self.values[len(index):]])
+        return index.search(text)[self.rows[start:self.size]]
+
+    def nbytes(self):
+        return self.rows[:self.size].nbytes + \
+            sum(sys.getsizeof(x) for x in self.values)
+
+
+def new_column(values):
+    """Create the column that fits the values best."""
+    dtypes = NumberColumn.dtypes(values)
+    if len(dtypes) == 1 and None not in dtypes:
+        column = NumberColumn(dtypes.pop())
+        if column.extend(values):
+            return column
+    column = EncodedColumn()
+    column.extend(values)
+    return column
+
+
+class ResultStore(object):
+    """Rows of a result kept by column.
+
+    Numbers are kept in arrays and everything else is dictionary encoded,
+    so a row takes a few bytes per column instead of a python object per
+    cell.  A column that starts out as numbers and then gets something else
+    is encoded from then on.
+
+    """
+
+    def __init__(self, keys, rows=()):
+        self.keys = list(keys)
+        self.columns = None
+        self.size = 0
+        self.extend(rows)
+
+    def __len__(self):
+        return self.size
+
+    def extend(self, rows):
+        """Add rows to the end of the store."""
+        if not rows:
+            return
+        values = zip(*rows)
+        if self.columns is None:
+            self.columns = [new_column(list(x)) for x in values]
+        else:
+            for i, column in enumerate(self.columns):
+                if not column.extend(list(values[i])):
+                    encoded = EncodedColumn()
+                    encoded.extend(column.all_values())
+                    encoded.extend(list(values[i]))
+                    self.columns[i] = encoded
+        self.size += len(rows)
+
+    def value(self, row, column):
+        return self.columns[column].value(row)
+
+    def row(self, row):
+        return tuple(x.value(row) for x in self.columns or [])
+
+    def argsort(self, column, descending=False):
+        """Get the rows sorted by a column."""
+        if not self.size:
+            return np.zeros(0, dtype=int)
+        order = self.columns[column].argsort()
+        if descending:
+            order = order[::-1]
+        return order
+
+    def matches(self, text, columns=None, start=0):
+        """Get a mask of the rows from start with text in any of the columns.
+
+        The search ignores case.
+
+        """
+        found = np.zeros(max(self.size - start, 0), dtype=bool)
+        if not self.size:
+            return found
+        text = text.lower()
+        if columns is None:
+            columns = range(len(self.columns))
+        for i in columns:
+            found |= self.columns[i].matches(text, start)
+        return found
+
+    def nbytes(self):
+        """Estimate the memory used by the rows in bytes."""
+        return sum(x.nbytes() for x in self.columns or [])
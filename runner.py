@@ -0,0 +1,314 @@
+import threading
+
+from PyQt4.QtCore import QObject, QThread, pyqtSignal
+
+from cache import result_key
+from explain import explain
+from metrics import QueryTiming
+
+
+def connection_id(connection):
+    """Get the server side id of a connection if the database has one."""
+    if connection.dialect.name == 'mysql':
+        return connection.execute('SELECT CONNECTION_ID()').scalar()
+    return None
+
+
+def interrupt(worker):
+    """Stop the query a worker thread is running on its connection.
+
+    Workers keep their engine, connection and its connection_id, and a lock
+    held while they change.  MySQL gets a KILL QUERY from another
+    connection, sent from a thread of its own.  Other drivers are
+    interrupted through the dbapi connection when they support it.
+
+    """
+    with worker.lock:
+        connection = worker.connection
+        connection_id = worker.connection_id
+        if connection_id is None:
+            interrupt_dbapi(connection)
+            return
+    thread = threading.Thread(target=kill_query,
+                              args=(worker, connection_id))
+    thread.daemon = True
+    thread.start()
+
+
+def interrupt_dbapi(connection):
+    if connection is None:
+        return
+    try:
+        dbapi = connection.connection.connection
+    except AttributeError:
+        return
+    for name in ('interrupt', 'cancel'):
+        if hasattr(dbapi, name):
+            try:
+                getattr(dbapi, name)()
+            except Exception:
+                pass
+            return
+
+
+def kill_query(worker, connection_id):
+    """Send KILL QUERY for a worker from a connection outside the pool.
+
+    The pool may have no connection to spare, and waiting for one is what
+    the query being killed is holding up.  The lock of the worker is held
+    until the kill is sent, so its connection can't go back to the pool
+    and start on someone else's query first.
+
+    """
+    with worker.lock:
+        if worker.connection_id != connection_id:
+            return
+        try:
+            engine = worker.engine
+            cargs, cparams = engine.dialect.create_connect_args(engine.url)
+            connection = engine.dialect.connect(*cargs, **cparams)
+            try:
+                cursor = connection.cursor()
+                cursor.execute('KILL QUERY %d' % connection_id)
+                cursor.close()
+            finally:
+                connection.close()
+        except Exception:
+            pass
+
+
+def release(worker):
+    """Forget the connection of a worker before it goes back to the pool."""
+    with worker.lock:
+        worker.connection = None
+        worker.connection_id = None
+
+
+class Cursor(object):
+    """An open result along with the connection it is holding."""
+
+    def __init__(self, connection, result):
+        self.connection = connection
+        self.result = result
+
+    def fetchmany(self, size):
+        return self.result.fetchmany(size)
+
+    def close(self):
+        """Close the result and give the connection back to the pool."""
+        try:
+            self.result.close()
+        finally:
+            self.connection.close()
+
+
+class QueryThread(QThread):
+    """Run a single query away from the gui thread.
+
+    Only the first batch of rows is fetched here.  If there are more rows the
+    result is left open on the cursor so the rest can be fetched as needed.
+    The runner decides if the results are still wanted once the thread
+    finishes.  The time taken to connect, execute and fetch is added to the
+    timing of the query.
+
+    With a cost guard the plan of the query is asked for first, and the
+    query isn't run if the guard holds it.
+
+    """
+
+    batch_size = 256
+
+    def __init__(self, engine, query, generation, timing, guard=None,
+                 confirmed=False):
+        """Initialize thread, the query won't run until start is called."""
+        QThread.__init__(self)
+        self.engine = engine
+        self.query = query
+        self.generation = generation
+        self.timing = timing
+        self.guard = guard
+        self.confirmed = confirmed
+        self.plan = None
+        self.held = False
+        self.cancelled = False
+        self.lock = threading.Lock()
+        self.connection = None
+        self.connection_id = None
+        self.keys = []
+        self.rows = []
+        self.cursor = None
+        self.error = None
+
+    def run(self):
+        try:
+            timing = self.timing
+            with timing.phase('connect'):
+                connection = self.engine.connect()
+            try:
+                self.connection_id = connection_id(connection)
+                self.connection = connection
+                if self.cancelled:
+                    return
+                if self.guard is not None:
+                    with timing.phase('explain'):
+                        self.plan = self.explain(connection)
+                    if not self.confirmed and self.guard.holds(self.plan):
+                        self.held = True
+                        return
+                with timing.phase('execute'):
+                    results = connection.execute(self.query)
+                with timing.phase('fetch'):
+                    self.keys = results.keys()
+                    self.rows = [tuple(x) for x in
+                                 results.fetchmany(self.batch_size)]
+                if len(self.rows) == self.batch_size:
+                    self.cursor = Cursor(connection, results)
+                else:
+                    results.close()
+            finally:
+                release(self)
+                if self.cursor is None:
+                    connection.close()
+        except Exception as e:
+            self.error = e
+
+    def explain(self, connection):
+        """Get the plan of the query, None if the database won't say."""
+        try:
+            return explain(connection, self.query)
+        except Exception:
+            return None
+
+    def close(self):
+        """Close the cursor if the results were never handed out."""
+        if self.cursor is not None:
+            self.cursor.close()
+            self.cursor = None
+
+    def cancel(self):
+        """Stop the running query, its results are never shown."""
+        self.cancelled = True
+        interrupt(self)
+
+
+class QueryRunner(QObject):
+    """Run scene queries on worker threads.
+
+    Only the newest query is ever reported.  Starting a query cancels the one
+    in flight and results from older queries are dropped when they arrive.
+
+    If there is a result cache, results that were fetched in full are kept
+    in it and reported straight away the next time the query is run.
+
+    The timing of the query last reported is kept on the runner.
+
+    With a cost guard every query is explained before it runs, plans are
+    cached on the guard by SQL so each is only asked for once.  A query the
+    guard holds is kept until it is confirmed.
+
+    """
+
+    results_ready = pyqtSignal(object, object, object)
+    query_failed = pyqtSignal(str)
+    running_changed = pyqtSignal(bool)
+    # the plan of the query being run
+    plan_ready = pyqtSignal(object)
+    # the plan of a query held by the guard
+    query_held = pyqtSignal(object)
+
+    def __init__(self, engine, cache=None, guard=None, parent=None):
+        """Initialize runner."""
+        QObject.__init__(self, parent)
+        self.engine = engine
+        self.cache = cache
+        self.guard = guard
+        self.held = None
+        self.generation = 0
+        self.current = None
+        self.from_cache = False
+        self.timing = None
+        self.threads = set()
+
+    def run(self, query, refresh=False, timing=None, confirmed=False):
+        """Cancel the current query and start running this one.
+
+        The query is a compiled statement.  Unless refresh is set, cached
+        results are reported without running it.  Confirmed queries are run
+        whatever their plan.
+
+        """
+        self.cancel()
+        self.generation += 1
+        self.held = None
+        if timing is None:
+            timing = QueryTiming(str(query))
+        self.timing = timing
+        if self.cache is not None and not refresh:
+            cached = self.cache.get(result_key(query))
+            if cached is not None:
+                self.from_cache = True
+                timing.cached = True
+                self.results_ready.emit(cached[0], cached[1], None)
+                return
+
+        self.from_cache = False
+        guard = self.guard
+        if guard is not None:
+            plan = guard.plans.get(str(query))
+            if plan is not None:
+                # the plan is known, there's no need to explain it again
+                guard = None
+                self.plan_ready.emit(plan)
+                if not confirmed and self.guard.holds(plan):
+                    self.hold(query, timing, plan)
+                    return
+        thread = QueryThread(self.engine, query, self.generation, timing,
+                             guard, confirmed)
+        thread.finished.connect(lambda: self.on_finished(thread))
+        self.threads.add(thread)
+        self.current = thread
+        self.running_changed.emit(True)
+        thread.start()
+
+    def cancel(self):
+        """Cancel the query in flight, if any."""
+        if self.current is not None:
+            self.current.cancel()
+            self.current = None
+            self.running_changed.emit(False)
+
+    def is_running(self):
+        return self.current is not None
+
+    def hold(self, query, timing, plan):
+        self.held = (query, timing)
+        self.query_held.emit(plan)
+
+    def confirm(self):
+        """Run the query the guard held."""
+        if self.held is not None:
+            query, timing = self.held
+            self.run(query, timing=timing, confirmed=True)
+
+    def on_finished(self, thread):
+        """Report the results of a thread unless it has gone stale."""
+        self.threads.discard(thread)
+        if thread.cancelled or thread.generation != self.generation:
+            thread.close()
+            return
+
+        self.current = None
+        self.running_changed.emit(False)
+        if thread.plan is not None:
+            self.guard.plans.put(thread.plan)
+            self.plan_ready.emit(thread.plan)
+        if thread.held:
+            self.hold(thread.query, thread.timing, thread.plan)
+        elif thread.error is not None:
+            self.query_failed.emit(str(thread.error))
+        else:
+            cursor, thread.cursor = thread.cursor, None
+            if cursor is None and self.cache is not None:
+                self.cache.put(result_key(thread.query), thread.keys,
+                               thread.rows)
+            self.results_ready.emit(thread.keys, thread.rows, cursor)
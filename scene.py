@@ -1,12 +1,18 @@
-import random, math
+import random, math, time
 
 from PyQt4.QtGui import (QGraphicsLineItem, QPen, QPolygonF, QGraphicsRectItem,
                          QGraphicsPolygonItem, QGraphicsSimpleTextItem,
                          QGraphicsScene, QGraphicsItem, QMenu, QAction,
                          QActionGroup, QGraphicsSceneMouseEvent)
 from PyQt4.QtCore import QPointF, QPoint, Qt, QDataStream, QVariant, QTimer, QObject, pyqtSignal, QString
-from sqlalchemy import select
 
+from layout import LayoutEngine
+from metrics import QueryTiming
+from paging import Pager
+from querybuilder import build_query, get_columns, missing_joins
+from querycache import QueryCache
+from scenefile import build_graph, scene_definition
+from scenegraph import SceneGraph
 
 
 #scene zoom factor (deals with spring graph layout)
@@ -67,12 +73,11 @@ class ArrowPolygonItem(QGraphicsPolygonItem):
         self.setBrush(Qt.cyan)
 
 
-    def update_position(self, point1, point2):
+    def update_position(self, x1, y1, x2, y2):
 
-        rise = point2.y - point1.y
-        run = point2.x - point1.x
-        self.setX((run / 2) + point1.x)
-        self.setY((rise / 2) + point1.y)
+        rise = y2 - y1
+        run = x2 - x1
+        self.setPos((run / 2) + x1, (rise / 2) + y1)
         tan = math.degrees(math.atan2(rise, run))
         self.setRotation(tan)
 
@@ -84,18 +89,14 @@ class ArrowPolygonItem(QGraphicsPolygonItem):
 class Relation(QGraphicsLineItem):
     """ A spring represents a connection (fk) between two tables."""
 
-    instances = []
-    constant = 100.0
-    length = 1.0
-
-    def __init__(self, from_table, to_table, condition):
+    def __init__(self, from_table, to_table, condition=None):
         QGraphicsLineItem.__init__(self)
-        self.instances.append(self)
 
         # from/to table connections
         self.from_table = from_table
         self.to_table = to_table
-        self.condition = condition
+        self._condition = condition
+        self.attached = False
         from_table.table_move.connect(self.update_spring)
         to_table.table_move.connect(self.update_spring)
 
@@ -127,6 +128,21 @@ class Relation(QGraphicsLineItem):
         self.outer_join_action = outer_join_action
         self.menu = menu
 
+    @property
+    def condition(self):
+        """The join condition, from the foreign keys of the two tables.
+
+        It is only worked out once a query needs it, since that reflects
+        both tables.
+
+        """
+        if self._condition is None:
+            from_table, to_table = self.from_table, self.to_table
+            self._condition = from_table.schema.graph.condition(
+                from_table.name, from_table.table,
+                to_table.name, to_table.table)
+        return self._condition
+
     def is_outer(self):
         return not self.join_action.isChecked()
 
@@ -135,25 +151,17 @@ class Relation(QGraphicsLineItem):
 
     def update_spring(self):
         """Update the position of the line and arrow."""
-        zoom_point1 = self.from_table.point * zoom
-        zoom_point2 = self.to_table.point * zoom
-        self.setLine(zoom_point1.x, zoom_point1.y, zoom_point2.x, zoom_point2.y)
-        self.arrow.update_position(zoom_point1, zoom_point2)
+        x1, y1 = self.from_table.position()
+        x2, y2 = self.to_table.position()
+        x1, y1, x2, y2 = x1 * zoom, y1 * zoom, x2 * zoom, y2 * zoom
+        self.setLine(x1, y1, x2, y2)
+        self.arrow.update_position(x1, y1, x2, y2)
 
-    @classmethod
-    def apply_hookes_law(cls):
-        for spring in cls.instances:
-            d = spring.to_table.point - spring.from_table.point
-            displacement = cls.length - d.magnitude()
-            direction = d.normalize()
-
-            force = direction * cls.constant * displacement * 0.5
-            spring.to_table.apply_force(force)
-            spring.from_table.apply_force(-force)
-
-    @classmethod
-    def clear(cls):
-        cls.instances = []
+    def attach(self, layout_engine):
+        """Add the spring to the layout, both tables must be attached."""
+        layout_engine.add_edge(self.from_table.index, self.to_table.index)
+        layout_engine.wake([self.from_table.index, self.to_table.index])
+        self.attached = True
 
 
 class Mediator(QObject):
@@ -163,32 +171,17 @@ class Mediator(QObject):
 
 class Table(QGraphicsRectItem):
 
-    alias_dict = {}
-    instances = []
-    repulsion = 600.0
-    damping = 0.5
-
     @property
     def table_move(self):
         """Mimic a signal on this class."""
         return self._mediator.table_move
 
-    @property
-    def parent(self):
-        parents = (x.from_table for x in Relation.instances if x.to_table is self)
-        try:
-            return parents.next()
-        except StopIteration:
-            return None
-
-    @property
-    def child_relations(self):
-        return (x for x in Relation.instances if x.from_table is self)
+    def __init__(self, schema, name, vector, alias, mass=1.0):
+        """Create the item, the table is only reflected once it is used."""
 
-    def __init__(self, table, vector, mass=1.0):
-        """Documentation here"""
-
-        self.name = table.name
+        self.schema = schema
+        self.name = name
+        self.alias = alias
         self._mediator = Mediator()
 
         # layout widget
@@ -197,7 +190,9 @@ class Table(QGraphicsRectItem):
         width = text.boundingRect().width()
         QGraphicsRectItem.__init__(self, x, y, width + 10, 22)
 
-        self.table = table.alias(self.alias)
+        self._table = None
+        # the columns to select, None for all of them
+        self.columns = None
 
         self.setBrush(Qt.cyan)
         self.setPen(Qt.darkCyan)
@@ -210,47 +205,41 @@ class Table(QGraphicsRectItem):
         text.setX(x + 5)
         text.setY(y + 5)
 
-        self.point = vector
+        self._point = vector
         self.mass = mass
-        self.velocity = Vector(0, 0)
-        self.force = Vector(0, 0)
-        self.instances.append(self)
+        self.layout_engine = None
+        self.index = None
 
-    def apply_force(self, force):
-        af = force / self.mass
-        self.force = self.force + (force / self.mass)
+    @property
+    def table(self):
+        """The aliased sqlalchemy table."""
+        if self._table is None:
+            self._table = self.schema.table(self.name).alias(self.alias)
+        return self._table
 
-    @classmethod
-    def apply_coulombs_law(cls):
-        for from_table in cls.instances:
-            for to_table in cls.instances:
-                if from_table is to_table:
-                    continue
-                d = from_table.point - to_table.point
-                distance = d.magnitude() + 1.0
-                direction = d.normalize()
-
-                force = (direction * cls.repulsion) / (distance * distance * 0.5)
-                from_table.apply_force(force)
-                to_table.apply_force(-force)
+    @property
+    def point(self):
+        """The position of the table, owned by the layout once attached."""
+        return Vector(*self.position())
 
-    @classmethod
-    def clear(cls):
-        cls.instances = []
-        cls.alias_dict = {}
+    def position(self):
+        """The position of the table as an (x, y) tuple."""
+        if self.layout_engine is None:
+            return self._point.x, self._point.y
+        x, y = self.layout_engine.position(self.index)
+        return float(x), float(y)
 
-    @classmethod
-    def update_velocity(cls, timestep):
-        for table in cls.instances:
-            table.velocity = (table.velocity + table.force * timestep) * cls.damping
-            table.force = Vector(0, 0)
+    def attach(self, layout_engine, index=None):
+        """Add the table to the layout, which takes over its position.
 
-    @classmethod
-    def update_position(cls, timestep):
-        for table in cls.instances:
-            table.point = table.point + table.velocity * timestep
-            table.setX(table.point.x)
-            table.setY(table.point.y)
+        The index is given when the node was already added.
+
+        """
+        if index is None:
+            point = self._point
+            index = layout_engine.add_node(point.x, point.y, self.mass)
+        self.index = index
+        self.layout_engine = layout_engine
 
     def setX(self, val):
         QGraphicsRectItem.setX(self, val * zoom - (self.width / 2))
@@ -260,17 +249,15 @@ class Table(QGraphicsRectItem):
         QGraphicsRectItem.setY(self, val * zoom - (self.height / 2))
         self.table_move.emit()
 
-    @property
-    def alias(self):
-        if not hasattr(self, '_alias'):
-            letters = ''.join(x[0] for x in self.name.split('_'))
-            self._alias = letters
-            self.alias_dict.setdefault(letters, 0)
-            num = self.alias_dict.get(letters, None)
-            if num:
-                self._alias += str(num)
-            self.alias_dict[letters] += 1
-        return self._alias
+    def move_to(self, x, y):
+        """Move the table without emitting table_move.
+
+        The layout uses this to move every table before updating the
+        relations that moved, once per step.
+
+        """
+        QGraphicsRectItem.setPos(self, x * zoom - (self.width / 2),
+                                 y * zoom - (self.height / 2))
 
     def mousePressEvent(self, event):
         print 'click'
@@ -293,47 +280,102 @@ class Scene(QGraphicsScene):
 
     query_changed = pyqtSignal()
     table_changed = pyqtSignal(QString)
+    path_choices = 5
+    # seconds of layout to run per frame
+    frame_budget = 0.008
 
-    def __init__(self, parent=None):
+    def __init__(self, schema, parent=None):
         """Override scene to handle drag/drop."""
         QGraphicsScene.__init__(self, parent)
+        # items move all the time while laying out, an index only slows it down
+        self.setItemIndexMethod(QGraphicsScene.NoIndex)
+        self.schema = schema
+        self.graph = SceneGraph()
         self.selectionChanged.connect(self.on_selection_change)
         self.timer = QTimer()
+        self.timer.timeout.connect(self.run_layout)
+        self.layout_engine = LayoutEngine()
         self.constraints = ''
-
-    def addItem(self, widget):
-        QGraphicsScene.addItem(self, widget)
-        self.clearSelection()
-        widget.setSelected(True)
+        self.pager = Pager()
+        self.key_indexes = None
+        self.query_cache = QueryCache()
+        self.timing = None
+
+    def new_table(self, name, parent=None):
+        """Create an item for a table of the schema, near its parent."""
+        return Table(self.schema, name, self.near(parent),
+                     self.graph.alias(name))
+
+    def add_table(self, item, select=True):
+        """Add a table to the scene, selecting it by default."""
+        self.graph.add_table(item)
+        QGraphicsScene.addItem(self, item)
+        if select:
+            self.clearSelection()
+            item.setSelected(True)
         self.layout()
 
+    def add_relation(self, parent, child):
+        """Join a child table to a parent table in the scene."""
+        relation = Relation(parent, child)
+        relation.join_action.toggled.connect(self.structure_changed)
+        self.graph.add_relation(relation)
+        QGraphicsScene.addItem(self, relation)
+        return relation
+
+    def structure_changed(self):
+        """Rerun the query when the joins of the scene change."""
+        if self.selectedItems():
+            self.run_query()
+
     def layout(self):
 
         # if the layout is still running, do nothing
         if self.timer.isActive():
             return
-        self.timer.timeout.connect(self.run_layout)
         self.timer.start(10)
 
+    def sync_layout(self):
+        """Attach tables and relations that aren't in the layout yet."""
+        for table in self.graph.tables:
+            if table.layout_engine is None:
+                table.attach(self.layout_engine)
+        for relation in self.graph.relations:
+            if not relation.attached:
+                relation.attach(self.layout_engine)
+
     def run_layout(self):
-        points = Table.instances
-        Table.apply_coulombs_law()
-        Relation.apply_hookes_law()
-        Table.update_velocity(0.05)
-        Table.update_position(0.05)
-
-        k = 0.0
-        for point in Table.instances:
-            speed = point.velocity.magnitude()
-            k += speed * speed
-
-        if k < 0.01:
+        """Run the layout for a frame and move what moved.
+
+        The layout runs for the frame budget, a step of a large graph is
+        spread over several frames.  Every table that moved is then
+        positioned once and every relation with a moved end is updated once.
+        Qt repaints the scene once for the whole frame.  The layout stops
+        once every table has settled.
+
+        """
+        self.sync_layout()
+        engine = self.layout_engine
+        engine.run(time.time() + self.frame_budget)
+
+        moved = engine.moved_nodes()
+        positions = self.layout_engine.positions
+        for table in self.graph.tables:
+            if moved[table.index]:
+                x, y = positions[table.index]
+                table.move_to(float(x), float(y))
+        for relation in self.graph.relations:
+            if moved[relation.from_table.index] or \
+                    moved[relation.to_table.index]:
+                relation.update_spring()
+
+        if not engine.is_active():
             self.timer.stop()
 
     def dragEnterEvent(self, event):
 
         if len(self.selectedItems()) != 1 and \
-                len(Table.instances) > 0:
+                len(self.graph) > 0:
             return event.ignore()
         return event.acceptProposedAction()
 
@@ -344,34 +386,73 @@ class Scene(QGraphicsScene):
         items = self.selectedItems()
         event.acceptProposedAction()
         data = event.mimeData().data('application/x-qabstractitemmodeldatalist')
-        text = self.decode_data(data)[0][0].toString()
-        newtable = meta.tables[str(text)]
-        item = Table(newtable, Vector.random())
-        if items:
-            try:
-                condition = items[0].table.join(newtable)
-            except:
-                condition = None
-            spring = Relation(items[0], item, condition)
-            QGraphicsScene.addItem(self, spring)
-        self.addItem(item)
+        text = str(self.decode_data(data)[0][0].toString())
+        if not items:
+            self.add_table(self.new_table(text))
+            return
+
+        parent = items[0]
+        path = self.choose_path(parent.name, text, event.screenPos())
+        if path is None:
+            return
+
+        # add the tables along the path, each joined to the one before it
+        last = len(path) - 1
+        for i, name in enumerate(path[1:], 1):
+            item = self.new_table(name, parent)
+            self.add_relation(parent, item)
+            self.add_table(item, select=(i == last))
+            parent = item
+
+    def near(self, table):
+        """Get a starting point for a new table.
+
+        New tables start a spring's length away from the table they are
+        joined to, so the rest of the layout barely has to move.  Without
+        one they start at a random point.
+
+        """
+        if table is None:
+            return Vector.random()
+        x, y = table.position()
+        angle = random.uniform(0, 2 * math.pi)
+        length = self.layout_engine.spring_length
+        return Vector(x + math.cos(angle) * length, y + math.sin(angle) * length)
+
+    def choose_path(self, start, end, pos):
+        """Get the tables to go through to join one table to another.
+
+        Tables that aren't connected directly are joined through the shortest
+        path of foreign keys.  If there is more than one path the user picks
+        which one to use.  None is returned if the user cancels.
+
+        """
+        if start == end:
+            return [start, end]
+        paths = self.schema.graph.shortest_paths(start, end, self.path_choices)
+        if not paths:
+            return [start, end]
+        if len(paths) == 1 or len(paths[0]) == 2:
+            return paths[0]
+
+        menu = QMenu()
+        for path in paths:
+            menu.addAction(' -> '.join(path))
+        action = menu.exec_(pos)
+        if action is None:
+            return None
+        return paths[menu.actions().index(action)]
 
     def reset_scene(self):
+        self.timer.stop()
         self.clear()
-        Relation.clear()
-        Table.clear()
+        self.graph.clear()
+        self.layout_engine.clear()
+        self.query_cache.clear()
 
     def get_root(self):
         """Get the root table in the scene."""
-        table = Table.instances[0]
-        child = table
-        while 1:
-            parent = child.parent
-            if parent:
-                child = parent
-            else:
-                break
-        return child
+        return self.graph.root()
 
     def get_columns(self):
         """Get the columns to display.
@@ -380,42 +461,219 @@ class Scene(QGraphicsScene):
         the scene.
 
         """
-        selected = self.selectedItems()
-        col_lists = (x.table.c for x in selected)
-        return [y for x in col_lists for y in x]
+        return get_columns(self.selectedItems())
 
-    def join(self, query, table, outer=False):
-        """Recursively join all the tables in the scene.
+    def get_query(self):
+        """Create sqlalchemy query based on the contents of the scene.
 
-        This returns the joined sqlalchemy query.
+        The query is restricted to the current page.  If keyset pagination is
+        used the key columns are added to the query when they are not
+        selected, their positions are kept in key_indexes.
 
         """
-        for relation in table.child_relations:
-            child = relation.to_table
+        query, self.key_indexes = build_query(self.graph, self.selectedItems(),
+                                              self.constraints, self.pager)
+        return query
+
+    def rows_key(self):
+        """Get a key for the rows of the scene, the same for every page."""
+        return (self.graph.signature(),
+                tuple(x.alias for x in self.selectedItems()), self.constraints)
+
+    def export_query(self):
+        """Get a query for every row of the scene, without paging."""
+        return build_query(self.graph, self.selectedItems(),
+                           self.constraints)[0]
 
-            if relation.condition is None:
-                continue
+    def constraint_query(self, constraints):
+        """Get the query of the scene with other constraints, without paging."""
+        return build_query(self.graph, self.selectedItems(), constraints)[0]
 
-            if relation.is_outer() or outer:
-                query = query.outerjoin(child.table)
+    def join_warnings(self):
+        """Describe the relations that can't be joined on a foreign key."""
+        return ['{0} and {1} have no join condition, they are cross '
+                'joined'.format(x.from_table.alias, x.to_table.alias)
+                for x in missing_joins(self.graph)]
+
+    def definition(self):
+        """Describe the scene so it can be saved and run without the gui."""
+        return scene_definition(self.graph, self.selectedItems(),
+                                self.constraints)
+
+    def load(self, definition):
+        """Replace the scene with a saved one.
+
+        Tables saved with their positions are put back where they were and
+        frozen, so the layout doesn't run for them.  Tables without one start
+        near the table they are joined to, as new tables do, and are laid
+        out.  Nothing is reflected and no query is run until the tables are
+        used.
+
+        """
+        self.reset_scene()
+        self.constraints = definition.get('constraints', '')
+        self.pager.reset()
+        # the query is built once it is asked for
+        self.compiled = None
+
+        relation_entries = definition.get('relations', [])
+        parents = dict((x['to'], x['from']) for x in relation_entries)
+        tables = {}
+        selected = []
+        placed = []
+        for entry in definition['tables']:
+            alias = entry['alias']
+            self.graph.use_alias(alias)
+            if 'x' in entry and 'y' in entry:
+                point = Vector(entry['x'], entry['y'])
             else:
-                query = query.join(child.table)
+                point = self.near(tables.get(parents.get(alias)))
+            item = Table(self.schema, entry['name'], point, alias)
+            item.columns = entry.get('columns')
+            self.graph.add_table(item)
+            QGraphicsScene.addItem(self, item)
+            tables[alias] = item
+            if 'x' in entry and 'y' in entry:
+                placed.append(item)
+            if entry.get('selected'):
+                selected.append(item)
+
+        relations = []
+        for entry in relation_entries:
+            relation = Relation(tables[entry['from']], tables[entry['to']])
+            relation.outer_join_action.setChecked(entry.get('outer', False))
+            relation.join_action.toggled.connect(self.structure_changed)
+            self.graph.add_relation(relation)
+            QGraphicsScene.addItem(self, relation)
+            relations.append(relation)
+
+        # the tables put back where they were join the layout frozen, the
+        # rest are attached and laid out by the layout as new tables are
+        if placed:
+            engine = self.layout_engine
+            indexes = engine.add_nodes([x.position() for x in placed],
+                                       [x.mass for x in placed], active=False)
+            for item, index in zip(placed, indexes):
+                item.attach(engine, index)
+                item.move_to(*item.position())
+            frozen = [x for x in relations
+                      if x.from_table.index is not None and
+                      x.to_table.index is not None]
+            engine.add_edges([(x.from_table.index, x.to_table.index)
+                              for x in frozen])
+            for relation in frozen:
+                relation.attached = True
+                relation.update_spring()
+        if len(placed) < len(self.graph.tables):
+            self.layout()
+
+        # selecting the tables would run the query
+        self.blockSignals(True)
+        try:
+            for item in selected:
+                item.setSelected(True)
+        finally:
+            self.blockSignals(False)
 
-            query = self.join(query, child, relation.is_outer())
-        return query
+    def neighbour_queries(self, names):
+        """Get the queries the scene would run if each table was dropped on it.
 
-    def get_query(self):
-        """Create sqlalchemy query based on the contents of the scene."""
-        root = self.get_root()
-        base = root.table
-        cols = self.get_columns()
-        query = select(cols, self.constraints, from_obj=self.join(base, root))
-        return query.limit(100)
+        The tables are joined to the selected table as a drop would join
+        them, and are then the only table selected.  Each query is compiled
+        the same way as when it is run, so its results are cached under the
+        same key.
+
+        """
+        items = self.selectedItems()
+        if len(items) != 1:
+            return []
+        definition = self.definition()
+        for entry in definition['tables']:
+            entry['selected'] = False
+        queries = []
+        for name in names:
+            alias = self.graph.next_alias(name)
+            tables = definition['tables'] + [
+                {'name': name, 'alias': alias, 'selected': True}]
+            relations = definition['relations'] + [
+                {'from': items[0].alias, 'to': alias, 'outer': False}]
+            graph, selected = build_graph(self.schema, dict(
+                definition, tables=tables, relations=relations))
+            query = build_query(graph, selected, self.constraints,
+                                Pager(self.pager.page_size))[0]
+            queries.append(query.compile(bind=self.schema.engine))
+        return queries
+
+    def set_constraints(self, constraints):
+        """Change the where clause and rerun the query from the first page.
+
+        The constraints may come straight from a Qt text widget, a QString
+        has no strip so they are kept as a str.
+
+        """
+        self.constraints = str(constraints or '')
+        self.pager.reset()
+        if self.selectedItems():
+            self.run_query()
+
+    def build_query(self):
+        """Get the query for the scene, reusing it if it was built before.
+
+        Queries are cached on the structure of the scene (tables, aliases and
+        joins), the selected tables, the constraints and the page.  Along
+        with the query the compiled SQL and key indexes are kept, so going
+        back to an earlier selection doesn't build or compile anything.
+
+        The time spent building and compiling is kept in the timing of the
+        query.
+
+        """
+        timing = QueryTiming()
+        structure = self.graph.signature()
+        key = (tuple(x.alias for x in self.selectedItems()),
+               self.constraints, self.pager.key())
+        entry = self.query_cache.get(structure, key)
+        if entry is None:
+            with timing.phase('build'):
+                query = self.get_query()
+            with timing.phase('compile'):
+                compiled = query.compile(bind=self.schema.engine)
+                sql = str(compiled)
+            entry = (query, compiled, sql, self.key_indexes)
+            self.query_cache.put(structure, key, entry)
+        self.query, self.compiled, self.sql, self.key_indexes = entry
+        timing.sql = self.sql
+        self.timing = timing
+
+    def run_query(self):
+        """Build the query and let everyone know it changed."""
+        self.build_query()
+        self.query_changed.emit()
+
+    def next_page(self, last_row=None):
+        """Show the next page of results.
+
+        The last row of the current page is needed for keyset pagination.
+
+        """
+        key = None
+        if self.key_indexes and last_row is not None:
+            key = tuple(last_row[i] for i in self.key_indexes)
+        self.pager.next_page(key)
+        self.run_query()
+
+    def previous_page(self):
+        """Show the previous page of results."""
+        if not self.pager.has_previous():
+            return
+        self.pager.previous_page()
+        self.run_query()
 
     def on_selection_change(self):
         """Run a query based on the contents of the scene.
 
-        This only happens if it makes sense to do so.
+        This only happens if it makes sense to do so.  The query starts over
+        at the first page.
 
         """
         items = self.selectedItems()
@@ -424,8 +682,8 @@ class Scene(QGraphicsScene):
         elif len(items) == 1:
             name = items[0].name
             self.table_changed.emit(name)
-        self.query = self.get_query()
-        self.query_changed.emit()
+        self.pager.reset()
+        self.run_query()
 
 
     def decode_data(self, bytearray):
@@ -452,5 +710,3 @@ class Scene(QGraphicsScene):
             data.append(item)
 
         return data
-
-from querybrowser import meta
@@ -0,0 +1,87 @@
+import json
+
+from querybuilder import QueryRelation, QueryTable
+from scenegraph import SceneGraph
+
+
+# changed whenever saved scenes can't be read the same way
+version = 1
+
+
+def scene_definition(graph, selected, constraints=''):
+    """Describe a scene so it can be saved.
+
+    The tables are listed with their aliases, whether their columns are
+    selected and which ones if not all of them.  Tables of the gui keep
+    their positions, so the layout doesn't need to run again when they are
+    loaded.  Relations refer to tables by alias::
+
+        {"version": 1,
+         "tables": [{"name": "user", "alias": "u", "selected": true,
+                     "x": 0.0, "y": 0.0},
+                    {"name": "user_detail", "alias": "ud",
+                     "selected": true, "columns": ["id", "email"],
+                     "x": 1.204, "y": -0.35}],
+         "relations": [{"from": "u", "to": "ud", "outer": false}],
+         "constraints": "u.id > 10"}
+
+    """
+    selected = set(x.alias for x in selected)
+    tables = []
+    for table in graph.tables:
+        entry = {'name': table.name, 'alias': table.alias,
+                 'selected': table.alias in selected}
+        if getattr(table, 'columns', None) is not None:
+            entry['columns'] = list(table.columns)
+        if hasattr(table, 'position'):
+            x, y = table.position()
+            entry['x'], entry['y'] = round(x, 3), round(y, 3)
+        tables.append(entry)
+    relations = [{'from': x.from_table.alias, 'to': x.to_table.alias,
+                  'outer': x.is_outer()} for x in graph.relations]
+    return {'version': version, 'tables': tables, 'relations': relations,
+            'constraints': constraints}
+
+
+def write_scene(path, definition):
+    with open(path, 'w') as f:
+        json.dump(definition, f, indent=2, sort_keys=True)
+
+
+def read_scene(path):
+    """Read a saved scene, raising ValueError if it can't be used."""
+    with open(path) as f:
+        definition = json.load(f)
+    if definition.get('version') != version:
+        raise ValueError('{0}: unsupported scene version {1}'.format(
+            path, definition.get('version')))
+    return definition
+
+
+def build_graph(schema, definition):
+    """Create the tables and joins of a saved scene, without any graphics.
+
+    Join conditions come from the foreign keys of the schema, as they do
+    when tables are added to a scene.  Returns the graph and the selected
+    tables.
+
+    """
+    graph = SceneGraph()
+    tables = {}
+    selected = []
+    for entry in definition['tables']:
+        table = QueryTable(schema.table(entry['name']), entry['alias'],
+                           entry.get('columns'))
+        graph.add_table(table)
+        tables[table.alias] = table
+        if entry.get('selected'):
+            selected.append(table)
+
+    for entry in definition.get('relations', []):
+        parent = tables[entry['from']]
+        child = tables[entry['to']]
+        condition = schema.graph.condition(parent.name, parent.table,
+                                           child.name, child.table)
+        graph.add_relation(QueryRelation(parent, child, condition,
+                                         entry.get('outer', False)))
+    return graph, selected
@@ -0,0 +1,114 @@
+import re
+
+
+class SceneGraph(object):
+    """The tables of a scene and the relations joining them.
+
+    Relations go from a parent table to a child table.  Each table has at
+    most one parent, so the tables form a tree under the root table.  The
+    parent and children of a table are kept in maps that are updated as
+    relations are added and removed.
+
+    """
+
+    def __init__(self):
+        """Initialize an empty graph."""
+        self.clear()
+
+    def clear(self):
+        self.tables = []
+        self.relations = []
+        self.parents = {}
+        self.children = {}
+        self.aliases = {}
+
+    def __len__(self):
+        return len(self.tables)
+
+    def alias(self, name):
+        """Get a new alias for a table.
+
+        The alias is the first letter of each word in the name, with a number
+        added when it is already used.
+
+        """
+        alias = self.next_alias(name)
+        letters = ''.join(x[0] for x in name.split('_'))
+        self.aliases[letters] = self.aliases.get(letters, 0) + 1
+        return alias
+
+    def next_alias(self, name):
+        """Get the alias the table would have, without using it up."""
+        letters = ''.join(x[0] for x in name.split('_'))
+        num = self.aliases.get(letters, 0)
+        if num:
+            return letters + str(num)
+        return letters
+
+    def use_alias(self, alias):
+        """Keep an alias made elsewhere from being handed out again."""
+        match = re.match(r'(.*?)(\d*)$', alias)
+        letters, num = match.group(1), int(match.group(2) or 0)
+        self.aliases[letters] = max(self.aliases.get(letters, 0), num + 1)
+
+    def add_table(self, table):
+        self.tables.append(table)
+        self.children[table] = []
+
+    def remove_table(self, table):
+        """Remove a table along with the relations to and from it."""
+        for relation in list(self.children.get(table, [])):
+            self.remove_relation(relation)
+        relation = self.parents.get(table)
+        if relation is not None:
+            self.remove_relation(relation)
+        self.tables.remove(table)
+        del self.children[table]
+
+    def add_relation(self, relation):
+        self.relations.append(relation)
+        self.parents[relation.to_table] = relation
+        self.children.setdefault(relation.from_table, []).append(relation)
+
+    def remove_relation(self, relation):
+        self.relations.remove(relation)
+        if self.parents.get(relation.to_table) is relation:
+            del self.parents[relation.to_table]
+        self.children[relation.from_table].remove(relation)
+
+    def parent(self, table):
+        """Get the parent of a table, None for the root."""
+        relation = self.parents.get(table)
+        if relation is None:
+            return None
+        return relation.from_table
+
+    def child_relations(self, table):
+        """Get the relations from a table to its children."""
+        return self.children.get(table, [])
+
+    def root(self):
+        """Get the table at the top of the tree."""
+        if not self.tables:
+            return None
+        table = self.tables[0]
+        while table in self.parents:
+            table = self.parents[table].from_table
+        return table
+
+    def signature(self):
+        """Get a hashable summary of the tables and joins in the graph."""
+        tables = tuple((x.name, x.alias) for x in self.tables)
+        relations = tuple((x.from_table.alias, x.to_table.alias, x.is_outer())
+                          for x in self.relations)
+        return tables, relations
+
+    def descendants(self, table):
+        """Get the relations below a table, parents before children."""
+        relations = []
+        pending = [table]
+        while pending:
+            for relation in self.child_relations(pending.pop()):
+                relations.append(relation)
+                pending.append(relation.to_table)
+        return relations
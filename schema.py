@@ -0,0 +1,192 @@
+import os
+import hashlib
+import threading
+import cPickle as pickle
+
+from sqlalchemy import MetaData, Table
+from sqlalchemy.engine.reflection import Inspector
+
+from fkgraph import FkGraph
+
+
+# where reflected schemas are kept between runs
+cache_dir = os.path.expanduser(os.path.join('~', '.querybrowser', 'cache'))
+
+
+class Schema(object):
+    """The tables of a database, reflected lazily.
+
+    Only the table names and foreign keys are loaded up front.  Each table is
+    fully reflected the first time it is asked for.  Everything reflected is
+    kept in a cache on disk that is used as long as the fingerprint of the
+    database hasn't changed.
+
+    The foreign keys are indexed in graph, which is shared by everything that
+    needs to know how tables connect.
+
+    """
+
+    cache_version = 1
+
+    def __init__(self, engine, cache_dir=cache_dir):
+        """Load the schema from the cache or the database."""
+        self.engine = engine
+        self.cache_dir = cache_dir
+        self.meta = MetaData()
+        self.names = []
+        self.foreign_keys = []
+        self.columns = None
+        self.graph = None
+        self.dirty = False
+        # tables can be reflected from more than one thread
+        self.lock = threading.Lock()
+        self.load()
+
+    @property
+    def cache_path(self):
+        if self.cache_dir is None:
+            return None
+        key = hashlib.md5(str(self.engine.url)).hexdigest()
+        return os.path.join(self.cache_dir, key + '.pickle')
+
+    def load(self):
+        """Load names and foreign keys, from the cache if it is current."""
+        self.fingerprint = self.get_fingerprint()
+        if not self.read_cache():
+            self.names = sorted(self.engine.table_names())
+            self.foreign_keys = self.reflect_foreign_keys()
+            self.dirty = True
+            self.save()
+        self.graph = FkGraph(self.names, self.foreign_keys)
+
+    def table(self, name):
+        """Get a table, reflecting it the first time it is used."""
+        with self.lock:
+            table = self.meta.tables.get(name)
+            if table is None:
+                table = Table(name, self.meta, autoload=True,
+                              autoload_with=self.engine)
+                self.dirty = True
+        return table
+
+    def column_names(self):
+        """Get the column names of every table, loading them when first used.
+
+        They are only needed to search by column, so they aren't loaded with
+        the rest of the schema.
+
+        """
+        if self.columns is None:
+            self.columns = self.reflect_column_names()
+            self.dirty = True
+        return self.columns
+
+    def get_fingerprint(self):
+        """Get a cheap summary of the schema that changes when it does."""
+        dialect = self.engine.dialect.name
+        if dialect == 'mysql':
+            rows = self.engine.execute(
+                'SELECT table_name, create_time FROM information_schema.tables '
+                'WHERE table_schema = DATABASE() ORDER BY table_name')
+        elif dialect == 'sqlite':
+            rows = self.engine.execute(
+                'SELECT name, sql FROM sqlite_master ORDER BY name')
+        else:
+            rows = sorted(self.engine.table_names())
+        return hashlib.md5(repr([tuple(x) for x in rows])).hexdigest()
+
+    def reflect_foreign_keys(self):
+        """Get every foreign key in the database without reflecting tables.
+
+        Each foreign key is a tuple of (table, columns, referred table,
+        referred columns).
+
+        """
+        if self.engine.dialect.name == 'mysql':
+            rows = self.engine.execute(
+                'SELECT table_name, constraint_name, column_name, '
+                'referenced_table_name, referenced_column_name '
+                'FROM information_schema.key_column_usage '
+                'WHERE table_schema = DATABASE() '
+                'AND referenced_table_name IS NOT NULL '
+                'ORDER BY table_name, constraint_name, ordinal_position')
+            constraints = {}
+            order = []
+            for table, name, column, referred, referred_column in rows:
+                key = (table, name)
+                if key not in constraints:
+                    constraints[key] = (table, [], referred, [])
+                    order.append(key)
+                constraints[key][1].append(column)
+                constraints[key][3].append(referred_column)
+            return [(t, tuple(c), r, tuple(rc))
+                    for t, c, r, rc in (constraints[x] for x in order)]
+
+        inspector = Inspector.from_engine(self.engine)
+        fks = []
+        for name in self.names:
+            for fk in inspector.get_foreign_keys(name):
+                fks.append((name, tuple(fk['constrained_columns']),
+                            fk['referred_table'],
+                            tuple(fk['referred_columns'])))
+        return fks
+
+    def reflect_column_names(self):
+        """Get the names of the columns of each table by table name."""
+        columns = dict((x, []) for x in self.names)
+        if self.engine.dialect.name == 'mysql':
+            rows = self.engine.execute(
+                'SELECT table_name, column_name FROM information_schema.columns '
+                'WHERE table_schema = DATABASE() '
+                'ORDER BY table_name, ordinal_position')
+            for table, column in rows:
+                columns.setdefault(table, []).append(column)
+            return columns
+
+        inspector = Inspector.from_engine(self.engine)
+        for name in self.names:
+            columns[name] = [x['name'] for x in inspector.get_columns(name)]
+        return columns
+
+    def read_cache(self):
+        """Load the cached schema, returning False if it isn't usable."""
+        path = self.cache_path
+        if path is None or not os.path.exists(path):
+            return False
+        try:
+            with open(path, 'rb') as f:
+                data = pickle.load(f)
+        except Exception:
+            return False
+        if data.get('version') != self.cache_version or \
+                data.get('fingerprint') != self.fingerprint:
+            return False
+
+        self.names = data['names']
+        self.foreign_keys = data['foreign_keys']
+        self.columns = data.get('columns')
+        self.meta = data['meta']
+        self.dirty = False
+        return True
+
+    def save(self):
+        """Write the schema to the cache if anything new was reflected."""
+        path = self.cache_path
+        if path is None or not self.dirty:
+            return
+        data = {'version': self.cache_version,
+                'fingerprint': self.fingerprint,
+                'names': self.names,
+                'foreign_keys': self.foreign_keys,
+                'columns': self.columns,
+                'meta': self.meta}
+        try:
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            tmp = path + '.tmp'
+            with open(tmp, 'wb') as f:
+                pickle.dump(data, f, pickle.HIGHEST_PROTOCOL)
+            os.rename(tmp, path)
+        except (IOError, OSError):
+            return
+        self.dirty = False
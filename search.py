@@ -0,0 +1,181 @@
+import re
+from bisect import bisect_left
+
+
+def trigrams(text):
+    return set(map(''.join, zip(text, text[1:], text[2:])))
+
+
+def initials(name):
+    """Get the first letter of each word in a name, as aliases are made."""
+    return ''.join(x[0] for x in name.split('_') if x)
+
+
+class SearchIndex(object):
+    """Fuzzy search over table names, and optionally their column names.
+
+    A table matches when the text is a subsequence of its name, ignoring
+    case.  Matches are ranked, best first:
+
+        exact name, prefix, prefix of the initials of the words, substring
+        at the start of a word, substring, subsequence, then column names
+        matching as a prefix or substring
+
+    and within each rank by length and then name.  Tables are numbered in
+    that order up front, so ranking a match is a matter of sorting numbers.
+
+    Candidates are found with an index of the characters and trigrams of
+    each name, prefixes with a sorted list of the names.  Most
+    ranks are then set operations, only the candidates left over are checked
+    one at a time.
+
+    """
+
+    def __init__(self, names, columns=None):
+        """Index table names, columns maps table names to column names."""
+        self.names = sorted(set(names), key=lambda x: (len(x), x))
+        self.lower = [x.lower() for x in self.names]
+        self.ids = dict((x, i) for i, x in enumerate(self.names))
+        self.exact = {}
+        for i, name in enumerate(self.lower):
+            self.exact.setdefault(name, set()).add(i)
+        self.grams = self.build(self.lower)
+
+        # names in alphabetical order, each prefix is a slice of them
+        alphabetical = sorted((x, i) for i, x in enumerate(self.lower))
+        self.alphabetical = [x for x, _ in alphabetical]
+        self.alphabetical_ids = [i for _, i in alphabetical]
+
+        self.initials = {}
+        for i, name in enumerate(self.lower):
+            letters = initials(name)
+            for n in range(2, len(letters) + 1):
+                self.initials.setdefault(letters[:n], set()).add(i)
+
+        self.columns = None
+        if columns is not None:
+            self.set_columns(columns)
+
+    @staticmethod
+    def build(texts):
+        """Map each character and trigram to the texts it appears in."""
+        index = {}
+        for i, text in enumerate(texts):
+            for gram in trigrams(text).union(text):
+                index.setdefault(gram, []).append(i)
+        return dict((x, frozenset(y)) for x, y in index.iteritems())
+
+    def set_columns(self, columns):
+        """Index the column names of the tables too."""
+        self.use_columns(self.index_columns(columns))
+
+    def index_columns(self, columns):
+        """Build an index of the column names, for use_columns.
+
+        Tables share a lot of column names, so each distinct name is indexed
+        once along with the tables having it.  Nothing is changed, so this
+        can run on another thread while the table names are searched.
+
+        """
+        tables = {}
+        for name, names in columns.items():
+            table = self.ids.get(name)
+            if table is None:
+                continue
+            for column in names:
+                tables.setdefault(column.lower(), set()).add(table)
+        names = sorted(tables)
+        return names, [tables[x] for x in names], self.build(names)
+
+    def use_columns(self, index):
+        """Search the column names of an index from index_columns as well."""
+        self.columns, self.column_tables, self.column_grams = index
+
+    @staticmethod
+    def candidates(index, keys):
+        """Get the entries having every one of the keys."""
+        sets = sorted((index.get(x, frozenset()) for x in keys), key=len)
+        result = set(sets[0])
+        for other in sets[1:]:
+            if not result:
+                break
+            result &= other
+        return result
+
+    @classmethod
+    def substrings(cls, index, texts, text):
+        """Get the entries containing the text, from some candidates."""
+        keys = trigrams(text) or set(text)
+        return set(i for i in cls.candidates(index, keys)
+                   if text in texts[i])
+
+    def prefixed(self, text):
+        """Get the names starting with the text."""
+        end = text[:-1] + unichr(ord(text[-1]) + 1)
+        start = bisect_left(self.alphabetical, text)
+        stop = bisect_left(self.alphabetical, end, start)
+        return set(self.alphabetical_ids[start:stop])
+
+    def search(self, text, names=None, columns=False):
+        """Get the tables matching the text, best match first.
+
+        If names is given only those tables are considered.  Column names
+        are searched as well when columns is set and they were indexed.
+
+        """
+        text = text.lower()
+        if not text:
+            return list(self.names if names is None else names)
+        allowed = None
+        if names is not None and len(names) < len(self.names):
+            allowed = set(self.ids[x] for x in names if x in self.ids)
+
+        # a subsequence has every character of the text
+        lower = self.lower
+        found = self.candidates(self.grams, set(text))
+        if allowed is not None:
+            found &= allowed
+
+        if len(text) == 1:
+            substring = found
+        elif len(text) == 2:
+            substring = set(i for i in found if text in lower[i])
+        else:
+            substring = self.substrings(self.grams, lower, text) & found
+        exact = self.exact.get(text, set()) & found
+        prefix = (self.prefixed(text) & substring) - exact
+        initial = (self.initials.get(text, set()) & found) - exact - prefix
+        inner = substring - exact - prefix - initial
+        word = set(i for i in inner if '_' + text in lower[i])
+        inner -= word
+
+        subsequence = []
+        if len(text) > 1:
+            pattern = re.compile('.*?'.join(re.escape(x) for x in text))
+            rest = sorted(found - substring - initial)
+            subsequence = [i for i in rest if pattern.search(lower[i])]
+
+        ranked = sorted(exact) + sorted(prefix) + sorted(initial) + \
+            sorted(word) + sorted(inner) + subsequence
+        # a single letter is in nearly every column name
+        if columns and self.columns is not None and len(text) > 1:
+            ranked.extend(self.search_columns(text, set(ranked), allowed))
+        names = self.names
+        return [names[i] for i in ranked]
+
+    def search_columns(self, text, excluded, allowed=None):
+        """Get the tables not excluded that have a matching column."""
+        prefix = set()
+        inner = set()
+        for i in self.substrings(self.column_grams, self.columns, text):
+            column = self.columns[i]
+            if column.startswith(text):
+                prefix |= self.column_tables[i]
+            else:
+                inner |= self.column_tables[i]
+        if allowed is not None:
+            prefix &= allowed
+            inner &= allowed
+        prefix -= excluded
+        inner -= excluded
+        return sorted(prefix) + sorted(inner - prefix)
@@ -0,0 +1,199 @@
+import math
+
+import numpy as np
+from sqlalchemy import func, select
+
+from explain import explain
+
+
+def value_key(value):
+    """Get a hashable stand in for a value."""
+    try:
+        hash(value)
+    except TypeError:
+        return str(value)
+    return value
+
+
+def stable_hash(value):
+    """Hash a value so that distinct values rarely share a hash.
+
+    Python hashes ints and strings well, but floats, decimals and other
+    numbers hash to their integer part mixed with little of the rest, so
+    0.5 and 1.5 can collide.  Those are hashed by their repr instead.
+
+    """
+    if isinstance(value, (int, long, basestring)):
+        return hash(value)
+    return hash(repr(value))
+
+
+def mix(hashes):
+    """Spread python hashes over all 64 bits, small ints hash to themselves."""
+    h = np.array(hashes, dtype=np.int64).view(np.uint64)
+    h ^= h >> np.uint64(33)
+    h *= np.uint64(0xff51afd7ed558ccd)
+    h ^= h >> np.uint64(33)
+    h *= np.uint64(0xc4ceb9fe1a85ec53)
+    h ^= h >> np.uint64(33)
+    return h
+
+
+class HyperLogLog(object):
+    """Estimate the number of distinct values in a fixed amount of memory.
+
+    The top bits of each hash pick a register, which keeps the longest run
+    of leading zeros seen in the next 32 bits.  The standard error is about
+    1.04 / sqrt(2 ** precision), 1.6% with the default precision of 12.
+
+    """
+
+    def __init__(self, precision=12):
+        self.precision = precision
+        self.registers = np.zeros(1 << precision, dtype=np.uint8)
+
+    def add(self, values):
+        if not len(values):
+            return
+        hashes = mix([stable_hash(x) for x in values])
+        index = (hashes >> np.uint64(64 - self.precision)).astype(np.intp)
+        word = (hashes >> np.uint64(32 - self.precision)) & \
+            np.uint64(0xffffffff)
+        # the position of the highest bit, frexp is exact for 32 bit ints
+        exponent = np.frexp(word.astype(np.float64))[1]
+        rank = (33 - exponent).astype(np.uint8)
+        np.maximum.at(self.registers, index, rank)
+
+    def count(self):
+        m = float(len(self.registers))
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / np.sum(2.0 ** -self.registers.astype(float))
+        zeros = np.count_nonzero(self.registers == 0)
+        if estimate <= 2.5 * m and zeros:
+            # linear counting is better for small counts
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+
+class TopValues(object):
+    """The most common values of a stream, counted in bounded memory.
+
+    Counts are kept for at most twice the capacity of values.  When there
+    are more, every count is lowered by the count just outside the
+    capacity and the values left at nothing are dropped.  A count can be
+    short by at most the total taken off, the error, so the counts given
+    are the least each value was seen.
+
+    """
+
+    def __init__(self, capacity=50):
+        self.capacity = capacity
+        self.counts = {}
+        self.error = 0
+
+    def add(self, values):
+        counts = self.counts
+        for value in values:
+            counts[value] = counts.get(value, 0) + 1
+            if len(counts) > 2 * self.capacity:
+                self.prune()
+
+    def prune(self):
+        counts = self.counts
+        cut = sorted(counts.itervalues(), reverse=True)[self.capacity]
+        for value, count in counts.items():
+            if count <= cut:
+                del counts[value]
+            else:
+                counts[value] = count - cut
+        self.error += cut
+
+    def top(self, k):
+        """Get the k most common values seen more than once, with counts."""
+        items = sorted(self.counts.iteritems(), key=lambda x: -x[1])[:k]
+        return [x for x in items if x[1] > 1]
+
+
+class ColumnStats(object):
+    """Approximate statistics of a column, kept as its values stream by."""
+
+    def __init__(self, name):
+        self.name = name
+        self.rows = 0
+        self.nulls = 0
+        self.minimum = None
+        self.maximum = None
+        self.distinct = HyperLogLog()
+        self.common = TopValues()
+
+    def add(self, values):
+        self.rows += len(values)
+        self.nulls += sum(1 for x in values if x is None)
+        values = [value_key(x) for x in values if x is not None]
+        self.distinct.add(values)
+        self.common.add(values)
+        if not values:
+            return
+        try:
+            low, high = min(values), max(values)
+            if self.minimum is None or low < self.minimum:
+                self.minimum = low
+            if self.maximum is None or high > self.maximum:
+                self.maximum = high
+        except TypeError:
+            # values of types that don't compare
+            pass
+
+    def null_fraction(self):
+        if not self.rows:
+            return 0.0
+        return float(self.nulls) / self.rows
+
+    def summary(self, top=3):
+        """Get the statistics as strings, in the order of headers."""
+        common = ', '.join('{0} ({1})'.format(value, count)
+                           for value, count in self.common.top(top))
+        return [self.name, '~{0:,}'.format(self.distinct.count()),
+                '{0:.1%}'.format(self.null_fraction()), str(self.minimum),
+                str(self.maximum), common]
+
+
+class ResultStats(object):
+    """Statistics of each column of a result."""
+
+    headers = ['column', 'distinct', 'null', 'min', 'max', 'most common']
+
+    def __init__(self, keys):
+        self.columns = [ColumnStats(x) for x in keys]
+        self.rows = 0
+
+    def add(self, rows):
+        if not rows:
+            return
+        self.rows += len(rows)
+        for column, values in zip(self.columns, zip(*rows)):
+            column.add(values)
+
+    def summary(self):
+        """Describe the statistics as text, lined up in columns."""
+        table = [self.headers] + [x.summary() for x in self.columns]
+        widths = [max(len(x[i]) for x in table)
+                  for i in range(len(self.headers))]
+        return '\n'.join('  '.join(x.ljust(widths[i])
+                                   for i, x in enumerate(row)).rstrip()
+                         for row in table)
+
+
+def count_query(query):
+    """Get a query counting the rows of another."""
+    # labels keep columns of the same name apart in the subquery
+    return select([func.count()]).select_from(
+        query.apply_labels().alias('counted'))
+
+
+def estimate_rows(connection, query):
+    """Get the rows the database expects a query to have, None if unknown."""
+    plan = explain(connection, query.compile(dialect=connection.dialect))
+    if plan is None:
+        return None
+    return plan.estimate
@@ -0,0 +1,105 @@
+import threading
+
+from PyQt4.QtCore import QThread, pyqtSignal
+
+from runner import connection_id, interrupt, release
+from stats import ResultStats, count_query, estimate_rows
+from writers import stream
+
+
+class StatsThread(QThread):
+    """Count the rows of a query and describe its columns in the background.
+
+    The count starts with the estimate of the database and is only made
+    exact with a COUNT(*) when the estimate is small enough for that to be
+    cheap.  Without an estimate the count stops at the limit, and only says
+    there are more rows than that.  The statistics are taken from the first rows of the query,
+    streamed a chunk at a time, and reported after every chunk.
+
+    """
+
+    chunk_size = 1000
+    # rows the statistics are taken from
+    sample_size = 10000
+    # only count exactly when there are expected to be fewer rows than this
+    count_limit = 1000000
+
+    # the number of rows, and whether it is exact
+    count_ready = pyqtSignal(object, bool)
+    # there are more rows than this, it isn't known how many
+    count_over = pyqtSignal(object)
+    # the statistics so far, and whether they are done
+    stats_ready = pyqtSignal(object, bool)
+
+    def __init__(self, engine, query):
+        """Initialize thread, the query is run without paging."""
+        QThread.__init__(self)
+        self.engine = engine
+        self.query = query
+        self.cancelled = False
+        self.lock = threading.Lock()
+        self.connection = None
+        self.connection_id = None
+        self.error = None
+
+    def run(self):
+        try:
+            connection = self.engine.connect()
+            try:
+                self.connection_id = connection_id(connection)
+                self.connection = connection
+                if not self.cancelled:
+                    self.count(connection)
+                if not self.cancelled:
+                    self.collect(connection)
+            finally:
+                release(self)
+                connection.close()
+        except Exception as e:
+            if not self.cancelled:
+                self.error = e
+
+    def count(self, connection):
+        try:
+            estimate = estimate_rows(connection, self.query)
+        except Exception:
+            estimate = None
+        query = self.query
+        if estimate is not None:
+            self.count_ready.emit(estimate, False)
+            if estimate > self.count_limit:
+                return
+        else:
+            # nothing says how many rows there are, so don't count past the
+            # limit, one row more shows there are more
+            query = query.limit(self.count_limit + 1)
+        rows = connection.execute(count_query(query)).scalar()
+        if self.cancelled:
+            return
+        if rows > self.count_limit:
+            self.count_over.emit(self.count_limit)
+        else:
+            self.count_ready.emit(rows, True)
+
+    def collect(self, connection):
+        # the limit lets the stream end on its own, closing a server side
+        # cursor early would read the rest of the rows anyway
+        keys, cursor = stream(connection, self.query.limit(self.sample_size))
+        try:
+            stats = ResultStats(keys)
+            while not self.cancelled:
+                rows = cursor.fetchmany(self.chunk_size)
+                stats.add(rows)
+                done = len(rows) < self.chunk_size
+                if not self.cancelled:
+                    self.stats_ready.emit('Sampled {0:,} rows\n\n{1}'.format(
+                        stats.rows, stats.summary()), done)
+                if done:
+                    break
+        finally:
+            cursor.close()
+
+    def cancel(self):
+        """Stop counting, nothing more is reported."""
+        self.cancelled = True
+        interrupt(self)
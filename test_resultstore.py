@@ -0,0 +1,27 @@
+import datetime
+import unittest
+
+from resultstore import ResultStore
+
+
+class MatchesTest(unittest.TestCase):
+
+    def test_non_ascii(self):
+        rows = [(1, u'n\xe91'), (2, 'caf\xc3\xa9'), (3, u'plain')]
+        store = ResultStore(['id', 'name'], rows)
+        self.assertEqual(store.matches(u'N\xc9').tolist(),
+                         [True, False, False])
+        self.assertEqual(store.matches(u'\xe9').tolist(),
+                         [True, True, False])
+        self.assertEqual(store.matches('plain').tolist(),
+                         [False, False, True])
+
+    def test_non_ascii_sort(self):
+        # dates and strings don't compare, so they are sorted as text
+        rows = [(u'\xe9',), (datetime.date(2000, 1, 1),), (u'a',)]
+        store = ResultStore(['value'], rows)
+        self.assertEqual(store.argsort(0).tolist(), [1, 2, 0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,27 @@
+import csv
+import unittest
+from StringIO import StringIO
+
+from writers import CsvWriter
+
+
+class CsvWriterTest(unittest.TestCase):
+
+    def write(self, rows):
+        f = StringIO()
+        writer = CsvWriter(f, ['value'])
+        writer.write(rows)
+        f.seek(0)
+        return list(csv.reader(f))[1:]
+
+    def test_floats_round_trip(self):
+        values = [1234567.891234, 0.1234567890123456, 1.0 / 3, 1e-300, -0.0]
+        rows = self.write([(x,) for x in values])
+        self.assertEqual([float(x[0]) for x in rows], values)
+
+    def test_unicode(self):
+        self.assertEqual(self.write([(u'n\xe91',)]), [['n\xc3\xa91']])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,105 @@
+import csv
+import json
+import datetime
+import decimal
+from collections import OrderedDict
+
+
+def unique_keys(keys):
+    """Number repeated column names so each one can be told apart."""
+    seen = {}
+    result = []
+    for key in keys:
+        count = seen.get(key, 0)
+        seen[key] = count + 1
+        result.append('{0}_{1}'.format(key, count + 1) if count else key)
+    return result
+
+
+def text(value):
+    """Get a string as unicode, whatever it was encoded with."""
+    if isinstance(value, str):
+        try:
+            return value.decode('utf-8')
+        except UnicodeDecodeError:
+            return value.decode('latin-1')
+    return value
+
+
+def json_value(value):
+    if isinstance(value, str):
+        return text(value)
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, datetime.timedelta):
+        return value.total_seconds()
+    if isinstance(value, decimal.Decimal):
+        return str(value)
+    if isinstance(value, (buffer, bytearray)):
+        return text(str(value))
+    return value
+
+
+def csv_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, float):
+        # str keeps only 12 significant digits, repr all of them
+        return repr(value)
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        return value.isoformat()
+    return str(value)
+
+
+class CsvWriter(object):
+    """Write rows as CSV with a header row."""
+
+    def __init__(self, f, keys):
+        self.writer = csv.writer(f)
+        self.writer.writerow([csv_value(x) for x in keys])
+
+    def write(self, rows):
+        self.writer.writerows([csv_value(x) for x in row] for row in rows)
+
+
+class JsonLinesWriter(object):
+    """Write each row as a JSON object on a line of its own."""
+
+    def __init__(self, f, keys):
+        self.f = f
+        self.keys = [text(x) for x in unique_keys(keys)]
+
+    def write(self, rows):
+        keys = self.keys
+        self.f.writelines(
+            json.dumps(OrderedDict(zip(keys, (json_value(x) for x in row)))) +
+            '\n' for row in rows)
+
+
+# writers by file extension
+formats = OrderedDict([('csv', CsvWriter), ('jsonl', JsonLinesWriter)])
+
+
+def stream(connection, query):
+    """Execute a query so its rows are read from the server as needed.
+
+    Returns the column names and a cursor to fetch the rows from.
+    SQLAlchemy streams the results of drivers that support it.  MySQLdb
+    doesn't, so it is given a server side cursor directly.
+
+    """
+    dialect = connection.dialect
+    if dialect.name == 'mysql' and dialect.driver == 'mysqldb':
+        from MySQLdb.cursors import SSCursor
+        compiled = query.compile(dialect=dialect)
+        params = compiled.construct_params()
+        if compiled.positional:
+            params = [params[x] for x in compiled.positiontup]
+        cursor = connection.connection.cursor(SSCursor)
+        cursor.execute(str(compiled), params)
+        return [x[0] for x in cursor.description], cursor
+
+    result = connection.execution_options(stream_results=True).execute(query)
+    return result.keys(), result